@@ -1,13 +1,18 @@
+from asyncio import get_event_loop
 from base64 import b64encode
 from collections import deque
 from datetime import datetime
-from json import JSONDecodeError, dumps, loads
+from json import dumps, loads
 from pathlib import Path
-from typing import Optional
+from shutil import rmtree
+from tempfile import mkdtemp
+from typing import AsyncIterator, Callable, Optional, Tuple
 
 import aiofiles
+import sqlalchemy
 from fastapi import Cookie, FastAPI, Header
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from starlette.requests import Request
 from starlette.responses import (
     FileResponse,
@@ -15,6 +20,7 @@ from starlette.responses import (
     JSONResponse,
     RedirectResponse,
     Response,
+    StreamingResponse,
 )
 from starlette.templating import Jinja2Templates
 from torequests.utils import timeago, ttime
@@ -24,18 +30,32 @@ from uniparser.utils import get_host
 
 from . import __version__
 from .config import md5_checker
-from .crawler import crawl_once, find_next_check_time
+from .crawler import (change_history, crawl_once, find_next_check_time,
+                      get_load_histogram, host_breaker, result_keys_cache,
+                      validators_cache)
 from .models import (
     Group,
     Task,
+    dump_task_cursor,
+    get_task_query_deps,
     groups,
+    insert_result_list,
+    invalidate_task,
+    load_task_cursor,
     query_all_groups,
     query_feeds,
     query_group_task_ids,
     query_task_errors,
+    query_task_ids,
+    query_task_results,
     query_tasks,
+    result_keys,
+    results,
+    task_caches,
     tasks,
+    validators,
 )
+from .models import feeds as feeds_table
 from .settings import (
     Config,
     get_host_freq_list,
@@ -44,7 +64,8 @@ from .settings import (
     set_host_freq,
     setup_app,
 )
-from .utils import format_size, gen_rss
+from .utils import (FeedRenderer, RenderedDocument, dependent_cache,
+                    feed_renderers, format_size)
 
 description = "Watchdogs to keep an eye on the world's change.\nRead more: [https://github.com/ClericPy/watchdogs](https://github.com/ClericPy/watchdogs)"
 app = FastAPI(title="Watchdogs", description=description, version=__version__)
@@ -166,11 +187,25 @@ async def add_new_task(task: Task):
             values = dict(task)
             if not values.get('error'):
                 values['error'] = ''
+            # the history is saved in the results table
+            result_list = loads(values.pop('result_list', None) or '[]')
             # insert with task_id is None
             await db.execute(query=query, values=values)
+            if Config.scheduler or result_list:
+                task_id = await db.fetch_val(
+                    'select `task_id` from tasks where `name`=:name',
+                    values={'name': task.name})
+                if result_list:
+                    await insert_result_list(task_id, result_list,
+                                             datetime.now())
+                if Config.scheduler:
+                    await Config.scheduler.refresh(task_id)
         else:
             # update old task
-            query = 'update tasks set `name`=:name,`enable`=:enable,`tag`=:tag,`request_args`=:request_args,`origin_url`=:origin_url,`interval`=:interval,`work_hours`=:work_hours,`max_result_count`=:max_result_count,`custom_info`=:custom_info,`next_check_time`=:next_check_time where `task_id`=:task_id'
+            old_task = await db.fetch_one(
+                query=tasks.select().where(tasks.c.task_id == task.task_id))
+            invalidate_task(old_task and dict(old_task))
+            query = 'update tasks set `name`=:name,`enable`=:enable,`tag`=:tag,`request_args`=:request_args,`origin_url`=:origin_url,`interval`=:interval,`work_hours`=:work_hours,`max_result_count`=:max_result_count,`custom_info`=:custom_info,`next_check_time`=:next_check_time,`failures`=0 where `task_id`=:task_id'
             values = {
                 'task_id': task.task_id,
                 'name': task.name,
@@ -185,8 +220,10 @@ async def add_new_task(task: Task):
                 'next_check_time': datetime.now(),
             }
             await db.execute(query=query, values=values)
+            if Config.scheduler:
+                await Config.scheduler.refresh(task.task_id)
         result = {'msg': 'ok'}
-        query_tasks.cache_clear()
+        invalidate_task(task)
     except Exception as e:
         result = {'msg': repr(e)}
     logger.info(
@@ -198,10 +235,23 @@ async def add_new_task(task: Task):
 @app.get("/delete_task")
 async def delete_task(task_id: int):
     try:
+        old_task = await Config.db.fetch_one(
+            query=tasks.select().where(tasks.c.task_id == task_id))
         query = tasks.delete().where(tasks.c.task_id == task_id)
         await Config.db.execute(query=query)
+        query = results.delete().where(results.c.task_id == task_id)
+        await Config.db.execute(query=query)
+        query = result_keys.delete().where(result_keys.c.task_id == task_id)
+        await Config.db.execute(query=query)
+        result_keys_cache.remove(task_id)
+        query = validators.delete().where(validators.c.task_id == task_id)
+        await Config.db.execute(query=query)
+        validators_cache.remove(task_id)
+        change_history.remove(task_id)
+        if Config.scheduler:
+            Config.scheduler.remove(task_id)
         result = {'msg': 'ok'}
-        query_tasks.cache_clear()
+        invalidate_task({'task_id': task_id}, old_task and dict(old_task))
     except Exception as e:
         result = {'msg': repr(e)}
     logger.info(f'[Delete] task {task_id}: {result}')
@@ -224,6 +274,14 @@ async def force_crawl(task_name: str):
     return result
 
 
+def get_page_state(has_more: bool, page: int, after,
+                   before) -> Tuple[bool, bool]:
+    """(has_next, has_prev) of the page / cursor queries."""
+    if before and not after:
+        return True, has_more
+    return has_more, bool(after) or page > 1
+
+
 @app.get("/load_tasks")
 async def load_tasks(
     task_name: Optional[str] = None,
@@ -232,6 +290,8 @@ async def load_tasks(
     order_by: str = 'last_change_time',
     sort: str = 'desc',
     tag: str = '',
+    after: str = '',
+    before: str = '',
 ):
     try:
         _result, has_more = await query_tasks(
@@ -241,6 +301,8 @@ async def load_tasks(
             order_by=order_by,
             sort=sort,
             tag=tag,
+            after=load_task_cursor(after, order_by),
+            before=load_task_cursor(before, order_by),
         )
         _result = [task for task in _result]
         now = datetime.now()
@@ -250,7 +312,19 @@ async def load_tasks(
                 1,
                 1,
                 short_name=True)
-        result = {'msg': 'ok', 'tasks': _result, 'has_more': has_more}
+        has_next, has_prev = get_page_state(has_more, page, after, before)
+        result = {
+            'msg': 'ok',
+            'tasks': _result,
+            'has_more': has_next,
+            # consecutive failures of the hosts, and the opened circuit breakers
+            'hosts': host_breaker.to_dict(),
+        }
+        if _result and order_by and sort:
+            result['next_cursor'] = dump_task_cursor(
+                _result[-1], order_by) if has_next else ''
+            result['prev_cursor'] = dump_task_cursor(
+                _result[0], order_by) if has_prev else ''
     except Exception as e:
         result = {'msg': str(e), 'tasks': [], 'has_more': False}
     return result
@@ -262,8 +336,27 @@ async def enable_task(task_id: int, enable: int = 1):
     values = {'task_id': task_id, 'enable': enable}
     try:
         _result = await Config.db.execute(query, values)
+        if Config.scheduler:
+            await Config.scheduler.refresh(task_id)
         result = {'msg': 'ok', 'updated': _result}
-        query_tasks.cache_clear()
+        old_task = await Config.db.fetch_one(
+            query=tasks.select().where(tasks.c.task_id == task_id))
+        invalidate_task({'task_id': task_id}, old_task and dict(old_task))
+    except Exception as e:
+        result = {'msg': repr(e)}
+    return result
+
+
+@app.get("/cache_info")
+async def cache_info():
+    return {cache.__name__: cache.cache_info() for cache in task_caches}
+
+
+@app.get("/load_histogram")
+async def load_histogram(seconds: int = 3600, bucket: int = 1):
+    try:
+        result = await get_load_histogram(seconds, bucket)
+        result['msg'] = 'ok'
     except Exception as e:
         result = {'msg': repr(e)}
     return result
@@ -433,6 +526,118 @@ async def update_host_freq(host: str,
     return result
 
 
+def get_feed_channel(title: str, host: str) -> dict:
+    return {
+        'title': title,
+        'description': f'Watchdog on web change, v{__version__}.',
+        'link': f'https://{host}',
+    }
+
+
+def task_to_item(task) -> dict:
+    latest_result: dict = loads(task['latest_result'] or '{}')
+    if isinstance(latest_result, list):
+        logger.error(f'latest_result is list: {latest_result}')
+    link: str = latest_result.get('url') or task['origin_url']
+    description: str = latest_result.get('text') or ''
+    title: str = f'{task["name"]}#{latest_result.get("title", description[:Config.TEXT_SLICE_LENGTH])}'
+    return {
+        'title': title,
+        'link': link,
+        'guid': title,
+        'description': description,
+        'time': task['last_change_time'],
+    }
+
+
+def feed_to_item(feed) -> dict:
+    description: str = feed['text']
+    return {
+        'title': f'{feed["name"]}#{description[:Config.TEXT_SLICE_LENGTH]}',
+        'link': feed['url'],
+        'guid': str(feed['id']),
+        'description': description,
+        'time': feed['ts_create'],
+    }
+
+
+@dependent_cache(maxsize=Config.rss_cache_maxsize,
+                 get_deps=get_task_query_deps)
+async def render_rss(tag: str = '',
+                     task_ids: Tuple[int] = None,
+                     host: str = '',
+                     format: str = 'rss') -> RenderedDocument:
+    if task_ids:
+        tasks, _ = await query_tasks(task_ids=task_ids)
+    else:
+        tasks, _ = await query_tasks(tag=tag)
+    renderer = feed_renderers[format]
+    text = ''.join(
+        renderer.render(get_feed_channel('Watchdogs', host),
+                        map(task_to_item, tasks)))
+    return RenderedDocument(text, media_type=renderer.media_type)
+
+
+@dependent_cache(maxsize=Config.rss_cache_maxsize,
+                 get_deps=get_task_query_deps)
+async def render_rss_feeds(tag: str = '',
+                           task_ids: Tuple[int] = None,
+                           host: str = '',
+                           format: str = 'rss') -> RenderedDocument:
+    if task_ids:
+        feeds, _ = await query_feeds(task_ids=task_ids)
+    else:
+        feeds, _ = await query_feeds(tag=tag)
+    renderer = feed_renderers[format]
+    text = ''.join(
+        renderer.render(get_feed_channel('Watchdogs Timeline', host),
+                        map(feed_to_item, feeds)))
+    return RenderedDocument(text, media_type=renderer.media_type)
+
+
+task_caches.extend([render_rss, render_rss_feeds])
+
+
+def document_response(request: Request, document: RenderedDocument):
+    """304 for the same ETag, gzip content if accepted."""
+    headers = {'ETag': document.etag, 'Vary': 'Accept-Encoding'}
+    if document.match(request.headers.get('if-none-match', '')):
+        return Response(status_code=304, headers=headers)
+    headers['Content-Type'] = f'{document.media_type}; charset="utf-8"'
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        content = document.gzip_content
+    else:
+        content = document.content
+    return Response(content=content,
+                    media_type=document.media_type,
+                    headers=headers)
+
+
+async def stream_feed(renderer: FeedRenderer, channel: dict, query,
+                      to_item: Callable) -> AsyncIterator[str]:
+    """Render the items while reading the rows from the db cursor."""
+    yield renderer.head(channel)
+    first = True
+    async for row in Config.db.iterate(query=query):
+        yield renderer.item(to_item(row), first)
+        first = False
+    yield renderer.tail()
+
+
+def get_renderer(format: str) -> Optional[FeedRenderer]:
+    return feed_renderers.get(format)
+
+
+def bad_format_response(format: str):
+    return JSONResponse(
+        status_code=400,
+        content={
+            "message": f'bad format {format}, should be in {list(feed_renderers)}',
+        },
+    )
+
+
 @app.get("/rss")
 async def rss(
         request: Request,
@@ -440,9 +645,15 @@ async def rss(
         sign: str = '',
         host: str = Header('', alias='Host'),
         group_ids: str = '',
+        limit: int = 0,
+        format: str = 'rss',
 ):
+    renderer = get_renderer(format)
+    if not renderer:
+        return bad_format_response(format)
+    task_ids = None
     if group_ids:
-        task_ids = tuple(await query_group_task_ids(group_ids))
+        task_ids = tuple(sorted(await query_group_task_ids(group_ids)))
         if not task_ids:
             return JSONResponse(
                 status_code=404,
@@ -450,41 +661,23 @@ async def rss(
                     "message": 'query no tasks',
                 },
             )
-        tasks, _ = await query_tasks(task_ids=task_ids)
-    else:
-        tasks, _ = await query_tasks(tag=tag)
-    source_link = f'https://{host}'
-    xml_data: dict = {
-        'channel': {
-            'title': 'Watchdogs',
-            'description': f'Watchdog on web change, v{__version__}.',
-            'link': source_link,
-        },
-        'items': []
-    }
-    for task in tasks:
-        pubDate: str = task['last_change_time'].strftime(
-            format='%a, %d %b %Y %H:%M:%S')
-        latest_result: dict = loads(task['latest_result'] or '{}')
-        if isinstance(latest_result, list):
-            logger.error(f'latest_result is list: {latest_result}')
-        link: str = latest_result.get('url') or task['origin_url']
-        description: str = latest_result.get('text') or ''
-        title: str = f'{task["name"]}#{latest_result.get("title", description[:Config.TEXT_SLICE_LENGTH])}'
-        item: dict = {
-            'title': title,
-            'link': link,
-            'guid': title,
-            'description': description,
-            'pubDate': pubDate
-        }
-        xml_data['items'].append(item)
-    xml: str = gen_rss(xml_data)
-    response = Response(
-        content=xml,
-        media_type="application/xml",
-        headers={'Content-Type': 'application/xml; charset="utf-8"'})
-    return response
+    if limit > 0:
+        query = tasks.select()
+        if task_ids:
+            query = query.where(tasks.c.task_id.in_(task_ids))
+        elif tag:
+            query = query.where(tasks.c.tag == tag)
+        query = query.order_by(sqlalchemy.desc(
+            tasks.c.last_change_time)).limit(min(limit, Config.rss_max_limit))
+        return StreamingResponse(stream_feed(
+            renderer, get_feed_channel('Watchdogs', host), query,
+            task_to_item),
+                                 media_type=renderer.media_type)
+    document = await render_rss(tag=tag,
+                                task_ids=task_ids,
+                                host=host,
+                                format=format)
+    return document_response(request, document)
 
 
 @app.post("/lite")
@@ -493,11 +686,8 @@ async def post_lite(request: Request, tag: str = '', sign: str = ''):
     tasks, _ = await query_tasks(task_id=task_id)
     if tasks:
         task = tasks[0]
-        try:
-            result_list = loads(
-                task['result_list']) if task['result_list'] else []
-        except JSONDecodeError:
-            result_list = []
+        result_list = await query_task_results(task_id,
+                                               task['max_result_count'])
         return {'result_list': result_list}
     else:
         return {'result_list': []}
@@ -510,7 +700,13 @@ async def lite(
     sign: str = '',
     page: int = 1,
     group_ids: str = '',
+    after: str = '',
+    before: str = '',
 ):
+    cursor = {
+        'after': load_task_cursor(after),
+        'before': load_task_cursor(before),
+    }
     if group_ids:
         task_ids = tuple(await query_group_task_ids(group_ids))
         if not task_ids:
@@ -520,9 +716,11 @@ async def lite(
                     "message": 'query no tasks',
                 },
             )
-        tasks, has_more = await query_tasks(task_ids=task_ids, page=page)
+        tasks, has_more = await query_tasks(task_ids=task_ids,
+                                            page=page,
+                                            **cursor)
     else:
-        tasks, has_more = await query_tasks(tag=tag, page=page)
+        tasks, has_more = await query_tasks(tag=tag, page=page, **cursor)
     now = datetime.now()
     for task in tasks:
         result = loads(task['latest_result'] or '{}')
@@ -542,19 +740,18 @@ async def lite(
     else:
         params = {'tag': tag}
     context['home_url'] = Config.get_route('/lite', **params)
-    if has_more:
-        if group_ids:
-            next_page_url = Config.get_route('/lite', page=page + 1, **params)
-        else:
-            next_page_url = Config.get_route('/lite', page=page + 1, **params)
+    has_next, has_prev = get_page_state(has_more, page, after, before)
+    if has_next and tasks:
+        next_page_url = Config.get_route('/lite',
+                                         after=dump_task_cursor(tasks[-1]),
+                                         **params)
     else:
         next_page_url = ''
     context['next_page_url'] = next_page_url
-    if page > 1:
-        if group_ids:
-            last_page_url = Config.get_route('/lite', page=page - 1, **params)
-        else:
-            last_page_url = Config.get_route('/lite', page=page - 1, **params)
+    if has_prev and tasks:
+        last_page_url = Config.get_route('/lite',
+                                         before=dump_task_cursor(tasks[0]),
+                                         **params)
     else:
         last_page_url = ''
     context['last_page_url'] = last_page_url
@@ -571,8 +768,11 @@ async def feeds(
     page: int = 1,
     # page_size: int = Config.default_page_size,
     group_ids: str = '',
+    after_id: int = 0,
+    before_id: int = 0,
 ):
     error_tasks = []
+    is_first_page = page == 1 and not after_id and not before_id
     if group_ids:
         task_ids = tuple(await query_group_task_ids(group_ids))
         if not task_ids:
@@ -584,13 +784,18 @@ async def feeds(
             )
         feeds, has_more = await query_feeds(task_ids=task_ids,
                                             tag=tag,
-                                            page=page)
-        if page == 1:
+                                            page=page,
+                                            after_id=after_id,
+                                            before_id=before_id)
+        if is_first_page:
             error_tasks.extend(await query_task_errors(tag=tag,
                                                        task_ids=task_ids))
     else:
-        feeds, has_more = await query_feeds(tag=tag, page=page)
-        if page == 1:
+        feeds, has_more = await query_feeds(tag=tag,
+                                            page=page,
+                                            after_id=after_id,
+                                            before_id=before_id)
+        if is_first_page:
             error_tasks.extend(await query_task_errors(tag=tag))
     now = datetime.now()
     _feeds = []
@@ -615,19 +820,18 @@ async def feeds(
     else:
         params = {'tag': tag}
     context['home_url'] = Config.get_route('/feeds', **params)
-    if has_more:
-        if group_ids:
-            next_page_url = Config.get_route('/feeds', page=page + 1, **params)
-        else:
-            next_page_url = Config.get_route('/feeds', page=page + 1, **params)
+    has_next, has_prev = get_page_state(has_more, page, after_id, before_id)
+    if has_next and feeds:
+        next_page_url = Config.get_route('/feeds',
+                                         after_id=feeds[-1]['id'],
+                                         **params)
     else:
         next_page_url = ''
     context['next_page_url'] = next_page_url
-    if page > 1:
-        if group_ids:
-            last_page_url = Config.get_route('/feeds', page=page - 1, **params)
-        else:
-            last_page_url = Config.get_route('/feeds', page=page - 1, **params)
+    if has_prev and feeds:
+        last_page_url = Config.get_route('/feeds',
+                                         before_id=feeds[0]['id'],
+                                         **params)
     else:
         last_page_url = ''
     context['last_page_url'] = last_page_url
@@ -640,9 +844,16 @@ async def rss_feeds(request: Request,
                     tag: str = '',
                     sign: str = '',
                     host: str = Header('', alias='Host'),
-                    group_ids: str = ''):
+                    group_ids: str = '',
+                    limit: int = 0,
+                    since_id: int = 0,
+                    format: str = 'rss'):
+    renderer = get_renderer(format)
+    if not renderer:
+        return bad_format_response(format)
+    task_ids = None
     if group_ids:
-        task_ids = tuple(await query_group_task_ids(group_ids))
+        task_ids = tuple(sorted(await query_group_task_ids(group_ids)))
         if not task_ids:
             return JSONResponse(
                 status_code=404,
@@ -650,38 +861,25 @@ async def rss_feeds(request: Request,
                     "message": 'query no tasks',
                 },
             )
-        feeds, _ = await query_feeds(task_ids=task_ids)
-    else:
-        feeds, _ = await query_feeds(tag=tag)
-    source_link = f'https://{host}'
-    xml_data: dict = {
-        'channel': {
-            'title': 'Watchdogs Timeline',
-            'description': f'Watchdog on web change, v{__version__}.',
-            'link': source_link,
-        },
-        'items': []
-    }
-    for feed in feeds:
-        pubDate: str = feed['ts_create'].strftime(
-            format='%a, %d %b %Y %H:%M:%S')
-        link: str = feed['url']
-        description: str = feed['text']
-        title: str = f'{feed["name"]}#{description[:Config.TEXT_SLICE_LENGTH]}'
-        item: dict = {
-            'title': title,
-            'link': link,
-            'guid': str(feed['id']),
-            'description': description,
-            'pubDate': pubDate
-        }
-        xml_data['items'].append(item)
-    xml: str = gen_rss(xml_data)
-    response = Response(
-        content=xml,
-        media_type="application/xml",
-        headers={'Content-Type': 'application/xml; charset="utf-8"'})
-    return response
+    if limit > 0 or since_id > 0:
+        if not task_ids and tag:
+            task_ids = tuple(await query_task_ids(tag=tag))
+        query = feeds_table.select()
+        if task_ids or tag:
+            query = query.where(feeds_table.c.task_id.in_(task_ids or ()))
+        if since_id > 0:
+            query = query.where(feeds_table.c.id > since_id)
+        limit = min(limit or Config.rss_max_limit, Config.rss_max_limit)
+        query = query.order_by(sqlalchemy.desc(feeds_table.c.id)).limit(limit)
+        return StreamingResponse(stream_feed(
+            renderer, get_feed_channel('Watchdogs Timeline', host), query,
+            feed_to_item),
+                                 media_type=renderer.media_type)
+    document = await render_rss_feeds(tag=tag,
+                                      task_ids=task_ids,
+                                      host=host,
+                                      format=format)
+    return document_response(request, document)
 
 
 @app.get("/groups")
@@ -734,6 +932,23 @@ async def update_group(group: Group, action: str):
 
 @app.get("/sqlite")
 async def download_db():
-    if Config.db_url.startswith('sqlite:///'):
-        return FileResponse(path=Config.db_url.replace('sqlite:///', ''))
-    return Response(content=b'not sqlite', status_code=404)
+    if not Config.db_url.startswith('sqlite:///'):
+        return Response(content=b'not sqlite', status_code=404)
+    from .sqlite import backup_sqlite
+
+    # the committed pages may be still in the WAL file, so download a snapshot
+    temp_dir = Path(mkdtemp(dir=Config.CONFIG_DIR))
+    snapshot_path = temp_dir / 'storage.sqlite'
+    try:
+        # 3.6 has no get_running_loop
+        await get_event_loop().run_in_executor(
+            None, backup_sqlite, Config.db_url.replace('sqlite:///', ''),
+            str(snapshot_path), Config.db_backup_pages, 0)
+    except BaseException:
+        rmtree(temp_dir, ignore_errors=True)
+        raise
+    return FileResponse(path=str(snapshot_path),
+                        filename='storage.sqlite',
+                        background=BackgroundTask(rmtree,
+                                                  temp_dir,
+                                                  ignore_errors=True))
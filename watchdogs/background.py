@@ -1,4 +1,6 @@
 from asyncio import ensure_future, sleep
+from datetime import datetime, timedelta
+
 from .utils import check_work_time, solo, try_catch
 from .config import Config
 
@@ -28,6 +30,25 @@ async def background_loop(coro_funcs: list = None):
         await sleep(Config.check_interval)
 
 
+async def scheduler_loop(crawl_once):
+    """Event-driven crawling for Config.scheduler_mode == 'heap'."""
+    scheduler = Config.scheduler
+    await scheduler.load()
+    while not Config.is_shutdown:
+        await scheduler.wait()
+        while not Config.is_shutdown:
+            task_ids = scheduler.pop_due(limit=Config.scheduler_chunk_size)
+            if not task_ids:
+                break
+            result = await try_catch(crawl_once, task_ids=tuple(task_ids))
+            if isinstance(result, BaseException):
+                Config.logger.error(f'crawl_once error, {result!r}')
+                # the popped tasks are pushed back only after crawled
+                scheduler.requeue(
+                    task_ids,
+                    datetime.now() + timedelta(seconds=Config.check_interval))
+
+
 async def db_backup_handler():
     logger = Config.logger
     if check_work_time(Config.db_backup_time):
@@ -36,3 +57,13 @@ async def db_backup_handler():
         with solo:
             result = await try_catch(Config.db_backup_function)
         logger.info(f'Backup DB finished: {result!r}')
+
+
+async def feeds_retention_handler():
+    from .retention import prune_feeds
+    logger = Config.logger
+    if check_work_time(Config.feeds_retention_time):
+        logger.warning(f'Feeds retention start: {Config.feeds_retention_time}.')
+        with solo:
+            result = await try_catch(prune_feeds)
+        logger.info(f'Feeds retention finished: {result!r}')
@@ -109,6 +109,27 @@ class Config:
     # db_url defaults to sqlite://
     db_url: str = f'sqlite:///{(CONFIG_DIR / "storage.sqlite").as_posix()}'
     db: Database = None
+    # connection pool of the db, the idle readers kept by the sqlite profile
+    db_pool_min_size: int = 1
+    db_pool_max_size: int = 10
+    # prepared statements cached by each connection, sqlite and postgresql
+    db_cached_statements: int = 256
+    # extra options for databases.Database
+    db_options: dict = {}
+    # log the SQL of the queries with literal binds, expensive
+    log_sql: bool = False
+    # WAL mode and one serialized writer connection for the sqlite:/// db_url
+    sqlite_profile: bool = True
+    # applied to each new sqlite connection
+    sqlite_pragmas: dict = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        # negative means KiB
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
     logger = logger
     password: str = ''
     rule_db: RuleStorage = None
@@ -116,6 +137,50 @@ class Config:
     check_interval: int = 60
     default_interval: int = 5 * 60
     default_crawler_timeout: int = 30
+    # max running crawls, a finished crawl frees its slot for the next task
+    crawl_concurrency: int = 200
+    # max queued tasks waiting for the free slots
+    crawl_queue_size: int = 1000
+    # max running crawls of each host
+    crawl_host_concurrency: int = 10
+    # crawl results are saved in one transaction per batch
+    crawl_result_batch_size: int = 100
+    # seconds to wait for more results before saving a batch
+    crawl_result_batch_interval: float = 1
+    # send If-None-Match / If-Modified-Since, skip parsing for 304 or the same body
+    conditional_crawl: bool = True
+    # processes for parsing the pages out of the event loop, 0 for disable
+    parse_workers: int = 0
+    # claim the due tasks with a lease in db, for the workers sharing one db
+    lease_tasks: bool = False
+    # the lease of a dead worker expires after lease_seconds
+    lease_seconds: int = 600
+    # hostname-pid-uuid, set on startup
+    worker_id: str = ''
+    # share one download between the due tasks of the same request_args (ignore the url fragment)
+    coalesce_requests: bool = True
+    # the failed task waits interval * 2 ** failures, up to backoff_max_seconds, 0 for disable
+    backoff_max_seconds: int = 6 * 3600
+    # open the circuit breaker of a host after n consecutive request failures, 0 for disable
+    host_breaker_failures: int = 5
+    # the opened host is skipped for the seconds (doubled by each failed probe, up to backoff_max_seconds), then probed by one request
+    host_breaker_seconds: int = 300
+    # spread the next_check_time of each task across its interval by a deterministic phase, 0 for disable
+    schedule_jitter: float = 1.0
+    # spread the overdue tasks across the seconds on startup, 0 for disable
+    startup_ramp_seconds: int = 300
+    # adjust the interval of the tasks by their change history, instead of the fixed task.interval
+    adaptive_interval: bool = False
+    # interval = ratio * max(median seconds between the changes, seconds since the latest change)
+    adaptive_interval_ratio: float = 0.5
+    adaptive_interval_min: int = 60
+    adaptive_interval_max: int = 86400
+    # recent change times of each task to guess the interval
+    adaptive_interval_samples: int = 10
+    # seconds to expire the cached host rules, for the workers sharing one db. 0 for never
+    host_rule_cache_ttl: int = 0
+    # seen result keys kept for each task, unique mode skips all of them
+    max_result_keys: int = 1000
     downloader_timeout: int = 15
     watchdog_auth: str = ''
     md5_salt: str = ''
@@ -149,11 +214,30 @@ class Config:
         "%(asctime)s %(levelname)-5s [%(name)s] %(filename)s(%(lineno)s): %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S")
     uvicorn_kwargs: dict = {'access_log': True, 'port': 9901}
+    # allow requests / aiohttp / tPool / Requests in UDFParser
+    allow_new_request: bool = False
     # check interval 60s, so format do use %M , backup every 12 hours. this pattern may miss for crawl cost more than 60s.
     # db_backup_time: str = '%H:%M==00:00|%H:%M==12:00'
     db_backup_time: str = '%H:%M==00:00'
     db_backup_count: int = 4
     db_backup_function: Callable[..., Any] = None
+    # pages copied per step of the sqlite backup, and the seconds to sleep between steps
+    db_backup_pages: int = 1024
+    db_backup_interval: float = 0.01
+    # compress the backup into storage-*.sqlite.gz
+    db_backup_gzip: bool = False
+    # delete the feeds older than the days / beyond the count of each task, 0 for disable
+    feeds_retention_days: int = 0
+    feeds_retention_count: int = 0
+    # same format as db_backup_time
+    feeds_retention_time: str = '%H:%M==03:00'
+    # small batches to avoid locking the db for long
+    feeds_retention_batch_size: int = 500
+    feeds_retention_batch_interval: float = 0.1
+    # archive the deleted feeds into CONFIG_DIR/archives/*.jsonl.gz
+    feeds_archive: bool = False
+    # free pages released by each incremental vacuum of SQLite
+    feeds_vacuum_pages: int = 10000
     exception_handlers: list = [
         (Exception, exception_handler),
     ]
@@ -173,12 +257,26 @@ class Config:
     query_task_ids_cache_maxsize = 128
     query_tasks_cache_maxsize = 128
     query_feeds_cache_maxsize = 128
+    # rendered rss documents of each tag / group
+    rss_cache_maxsize = 128
+    # max items of the streaming rss, which requested with limit / since_id
+    rss_max_limit = 1000
     metas_cache_maxsize = 128
     sign_cache_maxsize = 128
+    # tasks of the seen result keys cached in memory
+    result_keys_cache_maxsize = 1024
+    # parsed results of (rule, body), 0 for disable
+    parse_cache_maxsize = 1024
     _md5 = _md5
     get_sign = get_sign
     background_task = None
     background_funcs: List[Callable] = []
+    # 'poll': query the due tasks every check_interval;
+    # 'heap': keep the enabled tasks in memory, sleep until the next due task.
+    scheduler_mode: str = 'poll'
+    scheduler = None
+    scheduler_task = None
+    scheduler_chunk_size = 20
     is_shutdown = False
     custom_links = [
         {
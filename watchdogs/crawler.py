@@ -1,46 +1,104 @@
 # -*- coding: utf-8 -*-
 
-from asyncio import ensure_future, wait
+from asyncio import (CancelledError, Event, Future, Queue, TimeoutError,
+                     ensure_future, shield, wait, wait_for)
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
 from json import JSONDecodeError, dumps, loads
+from operator import add
+from time import time
 from traceback import format_exc
-from typing import Optional, Tuple
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 
-from torequests.utils import timeago, ttime
-from uniparser import Crawler, RuleNotFoundError
+from torequests.utils import guess_interval, timeago
+from uniparser import Crawler, CrawlerRule, RuleNotFoundError, Uniparser
+from uniparser.config import GlobalConfig
+from uniparser.utils import ensure_request, get_host
 
 from .config import Config
-from .models import Database, Task, query_feeds, query_tasks, tasks
-from .utils import (check_work_time, get_result_key, get_watchdog_result, solo,
-                    try_catch)
+from .models import (Database, Task, date0, invalidate_task, query_tasks,
+                     tasks)
+from .pool import parse_in_pool
+from .utils import (compile_work_hours, get_content_hash, get_next_work_time,
+                    get_result_key, get_result_key_hash, get_watchdog_result,
+                    solo, to_datetime, try_catch)
+
+
+INSERT_RESULT_QUERY = "INSERT INTO results (`task_id`, `result`, `time`) values (:task_id, :result, :time)"
+# the key hashes may be saved by the other workers, see Config.lease_tasks
+INSERT_RESULT_KEY_QUERY = "INSERT OR IGNORE INTO result_keys (`task_id`, `key_hash`) values (:task_id, :key_hash)"
+MYSQL_INSERT_RESULT_KEY_QUERY = "INSERT IGNORE INTO result_keys (`task_id`, `key_hash`) values (:task_id, :key_hash)"
+REPLACE_VALIDATOR_QUERY = "REPLACE INTO validators (`task_id`, `etag`, `last_modified`, `body_hash`, `rule_hash`) values (:task_id, :etag, :last_modified, :body_hash, :rule_hash)"
+LEASE_TASKS_QUERY = "update tasks set `lease_owner`=:lease_owner, `lease_until`=:lease_until where `task_id` in (:ids) and `enable`=1 and `next_check_time`<=:now and `lease_until`<:now"
+SELECT_LEASED_TASKS_QUERY = "select * from tasks where `task_id` in (:ids) and `lease_owner`=:lease_owner and `lease_until`=:lease_until"
+UPDATE_BACKOFF_QUERY = "update tasks set `failures`=:failures, `next_check_time`=:next_check_time where `task_id`=:task_id"
+INSERT_FEED_QUERY = "INSERT INTO feeds (`task_id`, `name`, `text`, `url`, `ts_create`) values (:task_id, :name, :text, :url, :ts_create)"
+
+
+@lru_cache(maxsize=256)
+def get_update_task_sql(keys: Tuple[str, ...]) -> str:
+    """The same shape of the update shares one SQL string, so the prepared statement could be reused."""
+    set_values = ", ".join(f'`{key}`=:{key}' for key in keys)
+    if set_values:
+        set_values = f'set {set_values}'
+    return f'update tasks {set_values} where `task_id`=:task_id'
+
+
+@lru_cache(maxsize=256)
+def get_in_sql(query: str, count: int) -> str:
+    """Expand the `:ids` of the raw query into count params, the same count
+    shares one SQL string, instead of compiling the in_ expression each time."""
+    return query.replace(':ids',
+                         ', '.join(f':id_{index}' for index in range(count)))
+
+
+def get_in_values(ids, values: Optional[dict] = None) -> dict:
+    values = dict(values or {})
+    values.update((f'id_{index}', value) for index, value in enumerate(ids))
+    return values
 
 
 class UpdateTaskQuery:
-    __slots__ = ('_query', 'values')
+    __slots__ = ('keys', 'values')
 
     def __init__(self, task_id):
-        self._query = []
+        self.keys: List[str] = []
         self.values = {'task_id': task_id}
 
     def add(self, key, value):
-        self._query.append(f'`{key}`=:{key}')
+        self.keys.append(key)
         self.values[key] = value
 
-    @property
-    def set_values(self):
-        if self._query:
-            return f'set {", ".join(self._query)}'
-        else:
-            return ''
-
     @property
     def kwargs(self):
         return {
-            'query': f'update tasks {self.set_values} where `task_id`=:task_id',
+            'query': get_update_task_sql(tuple(self.keys)),
             'values': self.values
         }
 
 
+def get_task_phase(task_id: int) -> float:
+    """Deterministic fraction in [0, 1) of each task, the golden ratio hashing
+    spreads the sequential task_ids evenly."""
+    return ((task_id or 0) * 2654435761 % 2**32) / 2**32
+
+
+def get_spread_check_time(task_id: int, interval: int,
+                          now: datetime) -> datetime:
+    """The next slot of `phase + k * interval` after now + interval / 2, so the tasks
+    with the same interval are spread across it instead of aligned to the same tick,
+    and the average interval keeps the same."""
+    jitter = Config.schedule_jitter
+    if jitter <= 0 or interval <= 0:
+        return now + timedelta(seconds=interval)
+    phase = get_task_phase(task_id) * interval * min(jitter, 1)
+    timestamp = now.timestamp() + interval / 2
+    slots = -((phase - timestamp) // interval)
+    return datetime.fromtimestamp(phase + slots * interval)
+
+
 def find_next_check_time(
     task: Task,
     now: Optional[datetime] = None,
@@ -73,15 +131,12 @@ Three kinds of format:
             %w==5#86400        means every Friday if it didn't change within 1 day
             0, 24#3600         means each hour if it didn't change within this hour. The task will only be crawled once if it has changed.
     '''
-    # find the latest hour fit work_hours, if not exist, return next day 00:00
     now = now or datetime.now()
-    work_hours = task.work_hours or '0, 24'
-    if '#' in work_hours:
+    work_hours = compile_work_hours(task.work_hours or '0, 24')
+    if work_hours.change_interval is not None:
         # check if changed
         last_change_time = task.last_change_time or datetime.fromtimestamp(0)
-        # split work_hours and change_interval
-        work_hours, change_interval_str = work_hours.split('#')
-        change_interval = int(change_interval_str)
+        change_interval = work_hours.change_interval
         # not fit change interval, will wait for left seconds.
         next_change_time = last_change_time + timedelta(seconds=change_interval)
         if now < next_change_time:
@@ -90,30 +145,278 @@ Three kinds of format:
             )
             return False, next_change_time
 
-    need_crawl = check_work_time(work_hours, now)
+    need_crawl = work_hours.check(now)
     if need_crawl:
         # current time is need_crawl, next_check_time is now+interval
-        next_check_time = now + timedelta(seconds=task.interval)
+        if Config.adaptive_interval:
+            interval = change_history.get_interval(task, now)
+        else:
+            interval = task.interval
+        next_check_time = get_spread_check_time(task.task_id, interval, now)
         return need_crawl, next_check_time
     else:
-        # current time is not need_crawl
-        next_check_time = now
-        # time machine to update next_check_time fast
-        for _ in range(60):
-            # next interval
-            next_check_time = next_check_time + timedelta(seconds=task.interval)
-            _need_crawl = check_work_time(work_hours, next_check_time)
-            if _need_crawl:
-                # current time is still False, but next_check_time is True
-                break
+        # current time is not need_crawl, jump to the start of the next work time
+        next_check_time = get_next_work_time(task.work_hours or '0, 24', now)
+        if next_check_time is None:
+            # no work time in the coming years
+            next_check_time = now + timedelta(seconds=task.interval * 60)
         return need_crawl, next_check_time
 
 
-async def crawl(task: Task):
+def get_backoff_check_time(task: Task, now: datetime) -> datetime:
+    """Wait interval * 2 ** failures after the failed crawl, up to Config.backoff_max_seconds."""
+    if Config.backoff_max_seconds <= 0:
+        return task.next_check_time
+    delay = min(task.interval * 2**min(task.failures, 20),
+                Config.backoff_max_seconds)
+    return max(task.next_check_time, now + timedelta(seconds=delay))
+
+
+class ValidatorCache:
+    """HTTP validators (ETag, Last-Modified) and the body hash of each task.
+
+    Loaded lazily for the tasks to crawl, the new validators are pending until
+    the crawl results saved by the writer, so a failed saving will not skip the
+    next crawl of the same body."""
+
+    def __init__(self):
+        self.cache: Dict[int, dict] = {}
+        self.pending: Dict[int, dict] = {}
+
+    async def load(self, task_ids: List[int]):
+        missing = tuple(
+            task_id for task_id in task_ids if task_id not in self.cache)
+        if not missing:
+            return
+        query = get_in_sql(
+            'select * from validators where `task_id` in (:ids)',
+            len(missing))
+        rows = await Config.db.fetch_all(query=query,
+                                         values=get_in_values(missing))
+        for row in rows:
+            self.cache[row.task_id] = dict(row)
+        for task_id in missing:
+            # empty dict for the task without validators, avoid reloading
+            self.cache.setdefault(task_id, {})
+
+    def get(self, task_id: int) -> dict:
+        return self.cache.get(task_id) or {}
+
+    def set_pending(self, task_id: int, validator: dict):
+        if validator != self.get(task_id):
+            self.pending[task_id] = validator
+        else:
+            self.pending.pop(task_id, None)
+
+    def pop_pending(self, task_id: int) -> Optional[dict]:
+        return self.pending.pop(task_id, None)
+
+    def update(self, values: List[dict]):
+        for validator in values:
+            self.cache[validator['task_id']] = validator
+
+    def remove(self, task_id: int):
+        self.cache.pop(task_id, None)
+        self.pending.pop(task_id, None)
+
+
+validators_cache = ValidatorCache()
+
+
+class ParseCache:
+    """LRU cache of the formatted result_list, keyed by (rule_hash, body_hash).
+
+    The same body parsed by the same rule gets the same result, skip the parsers."""
+
+    def __init__(self):
+        self.cache: 'OrderedDict[Tuple[str, str], list]' = OrderedDict()
+
+    def get(self, key: Tuple[str, str]) -> Optional[list]:
+        result_list = self.cache.get(key)
+        if result_list is None:
+            return None
+        self.cache.move_to_end(key)
+        return list(result_list)
+
+    def set(self, key: Tuple[str, str], result_list: list):
+        if Config.parse_cache_maxsize <= 0:
+            return
+        self.cache[key] = list(result_list)
+        self.cache.move_to_end(key)
+        while len(self.cache) > Config.parse_cache_maxsize:
+            self.cache.popitem(last=False)
+
+
+parse_cache = ParseCache()
+
+
+def get_rule_hash(rule: CrawlerRule, request_args: dict) -> str:
+    return get_content_hash(rule.dumps() + dumps(request_args, sort_keys=True))
+
+
+def get_request_fingerprint(request_args: dict) -> str:
+    """The same fingerprint means the same http request, the url fragment is
+    not sent, such as the tasks watching one page with different rules."""
+    # headers={} is the same as no headers
+    request_args = {
+        key: value
+        for key, value in request_args.items()
+        if value not in (None, {}, [])
+    }
+    url = request_args.get('url')
+    if isinstance(url, str):
+        request_args['url'] = url.split('#', 1)[0]
+    request_args['method'] = str(request_args.get('method') or 'get').lower()
+    return get_content_hash(dumps(request_args, sort_keys=True, default=repr))
+
+
+class InflightRequests:
+    """Coalesce the concurrent downloads of the same request (singleflight), the
+    followers wait for the response of the first one instead of requesting again."""
+
+    def __init__(self):
+        # fingerprint: (future of (text, resp), waiters)
+        self.flights: Dict[str, Tuple[Future, List[int]]] = {}
+
+    async def _download(self, request_args: dict):
+        host = get_host(request_args.get('url'), '')
+        try:
+            text, resp = await Config.uniparser.adownload(None, **request_args)
+        except CancelledError:
+            # all the waiters timeout
+            host_breaker.record(host, False)
+            raise
+        status_code = getattr(resp, 'status_code', None)
+        host_breaker.record(
+            host,
+            not isinstance(resp, Exception) and (status_code or 0) < 500)
+        return text, resp
+
+    async def download(self, request_args: dict):
+        if not Config.coalesce_requests:
+            return await self._download(request_args)
+        key = get_request_fingerprint(request_args)
+        flight = self.flights.get(key)
+        if flight is None:
+            future = ensure_future(self._download(request_args))
+            flight = self.flights[key] = (future, [0])
+            future.add_done_callback(lambda _: self.flights.pop(key, None)
+                                     if self.flights.get(key) is flight else None)
+        else:
+            Config.logger.info(
+                f'Coalesced request: {request_args.get("url")}')
+        future, waiters = flight
+        waiters[0] += 1
+        try:
+            # one cancelled waiter (timeout) should not cancel the others
+            return await shield(future)
+        finally:
+            waiters[0] -= 1
+            if not waiters[0] and not future.done():
+                future.cancel()
+
+
+inflight_requests = InflightRequests()
+
+
+async def crawl_sub_requests(crawl_result: dict, rule: CrawlerRule) -> bool:
+    """Crawl the __request__ of the result recursively, like Crawler.acrawl."""
+    uniparser: Uniparser = Config.uniparser
+    result = crawl_result[rule['name']]
+    if not isinstance(result, dict) or not uniparser._RECURSION_CRAWL:
+        return False
+    __request__ = result.get(GlobalConfig.__request__)
+    if not __request__:
+        return False
     crawler: Crawler = Config.crawler
+    if isinstance(__request__, (list, tuple)):
+        futures = [
+            ensure_future(crawler.acrawl(request)) if request else None
+            for request in __request__
+        ]
+        result[GlobalConfig.__result__] = [
+            (await future) if future else None for future in futures
+        ]
+    else:
+        result[GlobalConfig.__result__] = await crawler.acrawl(__request__)
+    return True
+
+
+async def download_and_parse(
+        task: Task,
+        conditional: bool = True) -> Tuple[str, Optional[list]]:
+    """Return the error and the result_list, result_list is None if the page is not modified."""
+    uniparser: Uniparser = Config.uniparser
+    request_args = ensure_request(task.request_args)
+    url = request_args['url']
+    rule = await Config.rule_db.find_crawler_rule(url)
+    if not rule:
+        return format_crawl_result(
+            task, RuleNotFoundError(f'No rule matched the given url: {url}'))
+    request_args = rule.get_request(**request_args)
+    rule_hash = get_rule_hash(rule, request_args)
+    validator = validators_cache.get(task.task_id)
+    conditional = (conditional and Config.conditional_crawl and
+                   validator.get('rule_hash') == rule_hash)
+    if conditional:
+        headers = dict(request_args.get('headers') or {})
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+        request_args['headers'] = headers
+    text, resp = await inflight_requests.download(request_args)
+    if isinstance(resp, Exception):
+        return format_crawl_result(task, resp)
+    status_code = getattr(resp, 'status_code', None)
+    if conditional and status_code == 304:
+        Config.logger.info(f'{task.name} not modified (304), skip parsing.')
+        return '', None
+    body_hash = get_content_hash(text) if isinstance(text, str) else None
+    new_validator = None
+    if status_code and 200 <= status_code < 300:
+        headers = resp.headers
+        new_validator = {
+            'task_id': task.task_id,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'body_hash': body_hash,
+            'rule_hash': rule_hash,
+        }
+        if conditional and body_hash == validator.get('body_hash'):
+            validators_cache.set_pending(task.task_id, new_validator)
+            Config.logger.info(f'{task.name} body not changed, skip parsing.')
+            return '', None
+    parse_key = (rule_hash, body_hash)
+    result_list = parse_cache.get(parse_key)
+    if result_list is not None:
+        Config.logger.info(
+            f'{task.name} Crawl success (parse cache): {result_list}'[:150])
+        error = ''
+        recursive = False
+    else:
+        if Config.parse_workers > 0:
+            crawl_result = await parse_in_pool(rule, text, resp, request_args)
+        else:
+            context = rule.context
+            context['resp'] = resp
+            context['request_args'] = request_args
+            crawl_result = await uniparser.aparse(text, rule, context)
+        recursive = False
+        if not isinstance(crawl_result, BaseException):
+            # the sub pages may change while the main page not, no cache for them
+            recursive = await crawl_sub_requests(crawl_result, rule)
+        error, result_list = format_crawl_result(task, crawl_result)
+        if body_hash and not error and not recursive:
+            parse_cache.set(parse_key, result_list)
+    if Config.conditional_crawl and new_validator and not error and not recursive:
+        validators_cache.set_pending(task.task_id, new_validator)
+    return error, result_list
+
+
+def format_crawl_result(task: Task,
+                        crawl_result) -> Tuple[str, Optional[list]]:
     logger = Config.logger
-    logger.info(f'Start crawling: {task.name}')
-    crawl_result = await try_catch(crawler.acrawl, task.request_args)
     error = ''
     if isinstance(crawl_result, RuleNotFoundError):
         error = repr(crawl_result)
@@ -143,40 +446,835 @@ async def crawl(task: Task):
             error = 'Invalid crawl_result against schema {rule_name: [{"text": "Required", "url": "Optional", "key": "Optional", "unique": "Optional"}]}, given is %r' % crawl_result
             logger.error(f'{task.name}: {error}')
             result_list = [{"text": error}]
+    return error, result_list
+
+
+async def crawl(task: Task, conditional: bool = True):
+    Config.logger.info(f'Start crawling: {task.name}')
+    result = await try_catch(download_and_parse, task, conditional)
+    if isinstance(result, BaseException):
+        error, result_list = format_crawl_result(task, result)
+    else:
+        # result_list is None if not modified
+        error, result_list = result
     return task, error, result_list
 
 
-async def _crawl_once(task_name: Optional[str] = None, chunk_size: int = 20):
-    """task_name means force crawl"""
+async def crawl_with_timeout(task: Task, conditional: bool = True):
+    future = ensure_future(crawl(task, conditional))
+    done, _ = await wait({future}, timeout=Config.default_crawler_timeout)
+    if done:
+        return future.result()
+    future.cancel()
+    Config.logger.error(f'crawl timeout: {task.name}')
+    return task, 'timeout(%s)' % Config.default_crawler_timeout, None
+
+
+class ResultKeysCache:
+    """Hashes of the seen result keys of each task, saved in the result_keys table.
+
+    The key hashes of the recent tasks are cached in memory (LRU), in insertion
+    order, so the dedupe is a set lookup without parsing the saved results."""
+
+    def __init__(self):
+        self.cache: 'OrderedDict[int, Dict[int, None]]' = OrderedDict()
+
+    async def load(
+        self, task_ids: List[int]
+    ) -> Tuple[Dict[int, Dict[int, None]], List[dict]]:
+        """Return the key hashes of the tasks, and the values of the key hashes
+        seeded from the results table which should be inserted."""
+        keys: Dict[int, Dict[int, None]] = {}
+        missing = []
+        for task_id in task_ids:
+            if task_id in self.cache:
+                keys[task_id] = self.cache[task_id]
+            else:
+                missing.append(task_id)
+        seed_values: List[dict] = []
+        if not missing:
+            return keys, seed_values
+        for task_id in missing:
+            keys[task_id] = {}
+        query = get_in_sql(
+            'select `task_id`, `key_hash` from result_keys where `task_id` in (:ids) order by `id`',
+            len(missing))
+        for row in await Config.db.fetch_all(query=query,
+                                             values=get_in_values(missing)):
+            keys[row.task_id][row.key_hash] = None
+        # lazy seed the tasks without key hashes from the saved results
+        to_seed = tuple(task_id for task_id in missing if not keys[task_id])
+        if to_seed:
+            query = get_in_sql(
+                'select `task_id`, `result` from results where `task_id` in (:ids) order by `id`',
+                len(to_seed))
+            for row in await Config.db.fetch_all(
+                    query=query, values=get_in_values(to_seed)):
+                try:
+                    key_hash = get_result_key_hash(loads(row.result))
+                except JSONDecodeError:
+                    continue
+                task_keys = keys[row.task_id]
+                if key_hash not in task_keys:
+                    task_keys[key_hash] = None
+                    seed_values.append({
+                        'task_id': row.task_id,
+                        'key_hash': key_hash
+                    })
+        return keys, seed_values
+
+    def update(self, task_id: int, task_keys: Dict[int, None]):
+        while len(task_keys) > Config.max_result_keys:
+            task_keys.pop(next(iter(task_keys)))
+        self.cache[task_id] = task_keys
+        self.cache.move_to_end(task_id)
+        while len(self.cache) > Config.result_keys_cache_maxsize:
+            self.cache.popitem(last=False)
+
+    def remove(self, task_id: int):
+        self.cache.pop(task_id, None)
+
+
+result_keys_cache = ResultKeysCache()
+
+
+class ChangeHistory:
+    """Recent change times of each task, for Config.adaptive_interval.
+
+    Loaded lazily from the distinct times of the results table, then appended
+    by save_crawl_results."""
+
+    def __init__(self):
+        self.cache: Dict[int, Deque[datetime]] = {}
+
+    async def load(self, task_ids: List[int]):
+        query = 'select distinct `time` from results where `task_id`=:task_id order by `time` desc limit :limit'
+        for task_id in task_ids:
+            if task_id in self.cache:
+                continue
+            rows = await Config.db.fetch_all(
+                query=query,
+                values={
+                    'task_id': task_id,
+                    'limit': Config.adaptive_interval_samples
+                })
+            # raw sql returns the str time of sqlite
+            times = [to_datetime(row.time) for row in rows]
+            self.cache[task_id] = deque(sorted(times),
+                                        maxlen=Config.adaptive_interval_samples)
+
+    def add(self, task_id: int, time: datetime):
+        if task_id in self.cache:
+            self.cache[task_id].append(time)
+
+    def remove(self, task_id: int):
+        self.cache.pop(task_id, None)
+
+    def get_interval(self, task: Task, now: datetime) -> int:
+        """Half of the median interval between the changes, or the time since the
+        latest change if it is longer, bounded by adaptive_interval_min / max."""
+        times = self.cache.get(task.task_id)
+        if not times or len(times) < 3:
+            return task.interval
+        period = guess_interval([time.timestamp() for time in times], 1)
+        period = max(period, (now - times[-1]).total_seconds())
+        interval = int(period * Config.adaptive_interval_ratio)
+        return min(max(interval, Config.adaptive_interval_min),
+                   Config.adaptive_interval_max)
+
+
+change_history = ChangeHistory()
+
+
+async def trim_task_result_keys(task_ids: List[int]):
+    """Keep the latest max_result_keys key hashes of the tasks."""
+    db: Database = Config.db
+    values = []
+    for task_id in task_ids:
+        query = 'select `id` from result_keys where `task_id`=:task_id order by `id` desc limit 1 offset :offset'
+        cutoff_id = await db.fetch_val(query=query,
+                                       values={
+                                           'task_id': task_id,
+                                           'offset': Config.max_result_keys
+                                       })
+        if cutoff_id is not None:
+            values.append({'task_id': task_id, 'cutoff_id': cutoff_id})
+    if values:
+        query = 'delete from result_keys where `task_id`=:task_id and `id`<=:cutoff_id'
+        await db.execute_many(query=query, values=values)
+
+
+async def trim_task_results(changed_tasks: List[Task]):
+    """Keep the latest max_result_count results of the changed tasks."""
+    db: Database = Config.db
+    values = []
+    for task in changed_tasks:
+        query = 'select `id` from results where `task_id`=:task_id order by `time` desc, `id` desc limit 1 offset :offset'
+        cutoff_id = await db.fetch_val(query=query,
+                                       values={
+                                           'task_id': task.task_id,
+                                           'offset': task.max_result_count
+                                       })
+        if cutoff_id is not None:
+            values.append({'task_id': task.task_id, 'cutoff_id': cutoff_id})
+    if values:
+        query = 'delete from results where `task_id`=:task_id and `id`<=:cutoff_id'
+        await db.execute_many(query=query, values=values)
+
+
+async def save_crawl_results(results: List[Tuple[Task, str, Optional[list]]]):
+    """Save the crawl results in one transaction, or one by one if the batch
+    failed, so one bad task will not roll back the others."""
+    states = [dict(task.__dict__) for task, _, _ in results]
+    try:
+        return await _save_crawl_results(results)
+    except Exception:
+        if len(results) == 1:
+            raise
+        Config.logger.error(
+            f'Save {len(results)} crawl results failed, retry one by one: {format_exc()}'
+        )
+    for (task, _, _), state in zip(results, states):
+        # restore the task variables modified by the failed batch
+        task.__dict__.update(state)
+    for result in results:
+        await try_catch(_save_crawl_results, [result])
+
+
+async def _save_crawl_results(results: List[Tuple[Task, str, Optional[list]]]):
+    """Save the crawl results into db in one transaction, then trigger the callbacks of the changed tasks."""
+    db: Database = Config.db
+    logger = Config.logger
+    now = datetime.now()
+    crawl_errors = []
+    changed_tasks = []
+    # query: list of values, the same columns share one execute_many
+    task_updates: Dict[str, List[dict]] = defaultdict(list)
+    feed_values: List[dict] = []
+    result_values: List[dict] = []
+    ok_task_ids = [
+        task.task_id
+        for task, error, result_list in results
+        if not error and result_list is not None
+    ]
+    keys, key_values = await result_keys_cache.load(ok_task_ids)
+    # task_id: the key hashes after saved
+    new_keys: Dict[int, Dict[int, None]] = {}
+    validator_values: List[dict] = []
+    backoff_values: List[dict] = []
+    for task, error, result_list in results:
+        validator = validators_cache.pop_pending(task.task_id)
+        if validator and not error:
+            validator_values.append(validator)
+        if error != task.error:
+            crawl_errors.append({'task_id': task.task_id, 'error': error})
+            task.error = error
+        if error or task.failures:
+            task.failures = task.failures + 1 if error else 0
+            if error:
+                task.next_check_time = get_backoff_check_time(task, now)
+            backoff_values.append({
+                'task_id': task.task_id,
+                'failures': task.failures,
+                'next_check_time': task.next_check_time
+            })
+        if error or result_list is None:
+            # ignore update this task
+            continue
+        # compare latest_result and new list
+        # later first, just like the saved results sortings
+        old_latest_result = loads(task.latest_result or '{}')
+        task_keys = keys[task.task_id]
+        # list of dict
+        to_insert_result_list = []
+        if old_latest_result.get('unique', True):
+            # unique mode will skip all the Duplicated results
+            for result in result_list:
+                if get_result_key_hash(result) in task_keys:
+                    break
+                to_insert_result_list.append(result)
+        else:
+            old_latest_result_key = get_result_key(old_latest_result)
+            for result in result_list:
+                if get_result_key(result) == old_latest_result_key:
+                    break
+                to_insert_result_list.append(result)
+        if to_insert_result_list:
+            # new result updated
+            query = UpdateTaskQuery(task.task_id)
+            # JSON
+            new_latest_result = dumps(to_insert_result_list[0],
+                                      sort_keys=True)
+            query.add('latest_result', new_latest_result)
+            query.add('last_change_time', now)
+            # older insert first, keep the newer is on the top
+            new_seeds = to_insert_result_list[::-1]
+            task_keys = dict(task_keys)
+            for result in new_seeds:
+                # result is dict, not json string
+                result_values.append({
+                    'task_id': task.task_id,
+                    'result': dumps(result),
+                    'time': now
+                })
+                key_hash = get_result_key_hash(result)
+                if key_hash in task_keys:
+                    # not unique mode, or duplicated in the new results
+                    continue
+                task_keys[key_hash] = None
+                key_values.append({
+                    'task_id': task.task_id,
+                    'key_hash': key_hash
+                })
+            new_keys[task.task_id] = task_keys
+            feed_values.extend(get_feed_values(new_seeds, task, now))
+            logger.info(f'[Updated] {task.name}. +++')
+            kwargs = query.kwargs
+            task_updates[kwargs['query']].append(kwargs['values'])
+            task.latest_result = new_latest_result
+            task.last_change_time = now
+            changed_tasks.append(task)
+    if crawl_errors or task_updates or key_values or validator_values or backoff_values or Config.lease_tasks:
+        async with db.transaction():
+            await release_leases([task.task_id for task, _, _ in results])
+            for update_query, values in task_updates.items():
+                await db.execute_many(query=update_query, values=values)
+            if result_values:
+                await db.execute_many(query=INSERT_RESULT_QUERY,
+                                      values=result_values)
+                await trim_task_results(changed_tasks)
+            if key_values:
+                await db.execute_many(query=MYSQL_INSERT_RESULT_KEY_QUERY
+                                      if Config.db_url.startswith('mysql')
+                                      else INSERT_RESULT_KEY_QUERY,
+                                      values=key_values)
+                await trim_task_result_keys([
+                    task_id for task_id, task_keys in new_keys.items()
+                    if len(task_keys) > Config.max_result_keys
+                ])
+            if feed_values:
+                await db.execute_many(query=INSERT_FEED_QUERY,
+                                      values=feed_values)
+            if crawl_errors:
+                update_query = 'update tasks set `error`=:error where task_id=:task_id'
+                await db.execute_many(query=update_query, values=crawl_errors)
+            if validator_values:
+                await db.execute_many(query=REPLACE_VALIDATOR_QUERY,
+                                      values=validator_values)
+            if backoff_values:
+                await db.execute_many(query=UPDATE_BACKOFF_QUERY,
+                                      values=backoff_values)
+    validators_cache.update(validator_values)
+    if Config.scheduler:
+        for task, error, _ in results:
+            if error and task.enable:
+                Config.scheduler.push(task.task_id, task.next_check_time)
+    for task in changed_tasks:
+        change_history.add(task.task_id, now)
+    for task_id in ok_task_ids:
+        result_keys_cache.update(task_id, new_keys.get(task_id, keys[task_id]))
+    logger.info(
+        f'Saved {len(results)} crawl results, Error: {len(crawl_errors)}, Update: {len(changed_tasks)}, Feeds: {len(feed_values)}.{" +++" if changed_tasks else ""}'
+    )
+    for task in changed_tasks:
+        ensure_future(try_catch(Config.callback_handler.callback, task))
+    if crawl_errors or changed_tasks or backoff_values:
+        error_task_ids = {item['task_id'] for item in crawl_errors}
+        error_task_ids.update(item['task_id'] for item in backoff_values)
+        invalidate_task(*changed_tasks,
+                        *(task for task, _, _ in results
+                          if task.task_id in error_task_ids))
+
+
+def get_task_host(task: Task) -> str:
+    request_args = ensure_request(task.request_args) or {}
+    return get_host(request_args.get('url'), '')
+
+
+def get_host_frequency(host: str) -> Tuple[int, float]:
+    freq = getattr(Uniparser, '_HOST_FREQUENCIES', {}).get(host, None)
+    if freq and freq.n:
+        return freq.n, freq.interval
+    return Config.DEFAULT_HOST_FREQUENCY
+
+
+class HostBreaker:
+    """Circuit breaker of each host, by the consecutive request failures.
+
+    After Config.host_breaker_failures failures the host is opened, its tasks are
+    deferred without requests. Once the open seconds passed, one task is started
+    as the half-open probe, success closes the host and failure opens it again
+    for the doubled seconds."""
+
+    def __init__(self):
+        self.failures: Dict[str, int] = {}
+        # host: timestamp, the opened hosts
+        self.open_until: Dict[str, float] = {}
+        # host: task_id of the half-open probe
+        self.probes: Dict[str, int] = {}
+
+    def get_delay(self, host: str) -> Optional[float]:
+        """Return 0 if the host is closed or could be probed, or the seconds
+        to wait for it, or None if waiting for the probe."""
+        until = self.open_until.get(host)
+        if until is None:
+            return 0
+        if host in self.probes:
+            return None
+        return max(until - time(), 0)
+
+    def start(self, host: str, task_id: int):
+        if host in self.open_until:
+            self.probes[host] = task_id
+            Config.logger.info(f'[Breaker] probing {host} with task {task_id}.')
+
+    def finish(self, host: str, task_id: int):
+        # the probe finished without any request, such as no rule matched
+        if self.probes.get(host) == task_id:
+            self.probes.pop(host, None)
+
+    def record(self, host: str, ok: bool):
+        if not host:
+            return
+        self.probes.pop(host, None)
+        if ok:
+            self.failures.pop(host, None)
+            if self.open_until.pop(host, None) is not None:
+                Config.logger.warning(f'[Breaker] {host} closed.')
+            return
+        failures = self.failures[host] = self.failures.get(host, 0) + 1
+        threshold = Config.host_breaker_failures
+        if threshold <= 0 or failures < threshold:
+            return
+        seconds = Config.host_breaker_seconds * 2**min(failures - threshold,
+                                                       20)
+        if Config.backoff_max_seconds > 0:
+            seconds = min(seconds, Config.backoff_max_seconds)
+        self.open_until[host] = time() + seconds
+        Config.logger.warning(
+            f'[Breaker] {host} opened for {seconds} seconds after {failures} failures.'
+        )
+
+    def to_dict(self) -> Dict[str, dict]:
+        return {
+            host: {
+                'failures': failures,
+                'open_until': datetime.fromtimestamp(self.open_until[host])
+                if host in self.open_until else None,
+                'probing': host in self.probes,
+            } for host, failures in self.failures.items()
+        }
+
+
+host_breaker = HostBreaker()
+
+
+async def defer_tasks(deferred: List[Task], until: datetime):
+    """Move the next_check_time of the tasks of an opened host after until."""
+    values = []
+    for task in deferred:
+        task.next_check_time = max(task.next_check_time, until)
+        values.append({
+            'task_id': task.task_id,
+            'next_check_time': task.next_check_time
+        })
+        if Config.scheduler and task.enable:
+            Config.scheduler.push(task.task_id, task.next_check_time)
+    query = 'update tasks set `next_check_time`=:next_check_time where `task_id`=:task_id'
+    async with Config.db.transaction():
+        await Config.db.execute_many(query=query, values=values)
+        await release_leases([task.task_id for task in deferred])
+    invalidate_task(*deferred)
+    Config.logger.info(
+        f'[Breaker] {len(deferred)} tasks deferred until {until}.')
+
+
+class CrawlEngine:
+    """Crawl pipeline with a global concurrency limit (Config.crawl_concurrency).
+
+    A finished crawl frees its slot for the next queued task at once, so a slow host
+    only holds its own slot, and the results are saved by the writer as they arrive.
+    Queued tasks are grouped by host and dispatched round-robin across the hosts,
+    a host is skipped while it is out of budget (Config.crawl_host_concurrency
+    running crawls, or the host frequency), before it takes a global slot.
+    The queued tasks of the hosts opened by host_breaker are deferred.
+    The queued tasks with the same request fingerprint are grouped and started
+    together, so they share one download of InflightRequests."""
+
+    def __init__(self):
+        # host: fingerprints of the queued groups
+        self.host_queues: Dict[str, Deque[str]] = {}
+        # fingerprint: the queued tasks of the same request
+        self.groups: Dict[str, List[Task]] = {}
+        # round-robin ring of the hosts which have queued tasks
+        self.hosts: Deque[str] = deque()
+        self.host_running: Dict[str, int] = defaultdict(int)
+        # start time of the latest n crawls of each host
+        self.host_starts: Dict[str, Deque[float]] = {}
+        self.queued: Set[int] = set()
+        self.running: Dict[int, Future] = {}
+        self.results: Optional[Queue] = None
+        self._wakeup: Optional[Event] = None
+        self._space: Optional[Event] = None
+        self._futures: List[Future] = []
+
+    def start(self):
+        # lazy init for the running loop
+        if self._wakeup is None:
+            self._wakeup = Event()
+            self._space = Event()
+            self.results = Queue()
+            self._futures = [
+                ensure_future(self._dispatch_loop()),
+                ensure_future(self._write_loop()),
+            ]
+
+    def is_pending(self, task_id: int) -> bool:
+        return task_id in self.running or task_id in self.queued
+
+    async def wait_for_space(self):
+        self.start()
+        while len(self.queued) >= Config.crawl_queue_size:
+            self._space.clear()
+            await self._space.wait()
+
+    def submit(self, task: Task):
+        self.start()
+        host = get_task_host(task)
+        if Config.coalesce_requests:
+            key = get_request_fingerprint(
+                ensure_request(task.request_args) or {})
+        else:
+            key = str(task.task_id)
+        self.queued.add(task.task_id)
+        group = self.groups.get(key)
+        if group is not None:
+            group.append(task)
+            self._wakeup.set()
+            return
+        self.groups[key] = [task]
+        queue = self.host_queues.get(host)
+        if queue is None:
+            queue = self.host_queues[host] = deque()
+            self.hosts.append(host)
+        queue.append(key)
+        self._wakeup.set()
+
+    def get_host_delay(self, host: str) -> Optional[float]:
+        """Return 0 if the host has budget now, or the seconds to wait for it,
+        or None if waiting for its running crawls."""
+        if not host:
+            # non-http request
+            return 0
+        breaker_delay = host_breaker.get_delay(host)
+        if breaker_delay != 0:
+            return breaker_delay
+        if self.host_running[host] >= Config.crawl_host_concurrency:
+            return None
+        n, interval = get_host_frequency(host)
+        starts = self.host_starts.get(host)
+        if not starts or len(starts) < n:
+            return 0
+        return max(starts[0] + interval - time(), 0)
+
+    def defer_host(self, host: str):
+        """Drop the queued tasks of the opened host, defer them in db."""
+        deferred = [
+            task for key in self.host_queues.pop(host, ())
+            for task in self.groups.pop(key, ())
+        ]
+        self.hosts.remove(host)
+        for task in deferred:
+            self.queued.discard(task.task_id)
+        until = datetime.fromtimestamp(host_breaker.open_until[host])
+        ensure_future(try_catch(defer_tasks, deferred, until))
+
+    def pop_tasks(self) -> Tuple[List[Task], Optional[float]]:
+        """Pop a group of the next host in budget, or return the seconds to wait."""
+        delay = None
+        for _ in range(len(self.hosts)):
+            if not self.hosts:
+                break
+            host = self.hosts[0]
+            self.hosts.rotate(-1)
+            if host and host_breaker.get_delay(host):
+                self.defer_host(host)
+                continue
+            host_delay = self.get_host_delay(host)
+            if host_delay == 0:
+                queue = self.host_queues[host]
+                group = self.groups.pop(queue.popleft())
+                if not queue:
+                    self.host_queues.pop(host, None)
+                    self.hosts.remove(host)
+                return group, None
+            elif host_delay is not None:
+                delay = host_delay if delay is None else min(delay, host_delay)
+        return [], delay
+
+    def start_tasks(self, group: List[Task]):
+        """Start the tasks of one request, they take one start of the host frequency."""
+        host = get_task_host(group[0])
+        n, _ = get_host_frequency(host)
+        starts = self.host_starts.get(host)
+        if starts is None or starts.maxlen != n:
+            starts = self.host_starts[host] = deque(starts or (), maxlen=n)
+        starts.append(time())
+        host_breaker.start(host, group[0].task_id)
+        for task in group:
+            self.queued.discard(task.task_id)
+            self.host_running[host] += 1
+            self.running[task.task_id] = ensure_future(self._crawl(task, host))
+
+    def dispatch(self) -> Optional[float]:
+        """Start the queued tasks until no free slot, return the seconds to wait."""
+        delay = None
+        while len(self.running) < Config.crawl_concurrency:
+            group, delay = self.pop_tasks()
+            if not group:
+                break
+            self.start_tasks(group)
+        return delay
+
+    async def _dispatch_loop(self):
+        while not Config.is_shutdown:
+            try:
+                delay = self.dispatch()
+            except Exception:
+                Config.logger.error(f'CrawlEngine dispatch error: {format_exc()}')
+                delay = Config.check_interval
+            self._space.set()
+            self._wakeup.clear()
+            try:
+                await wait_for(self._wakeup.wait(), timeout=delay)
+            except TimeoutError:
+                pass
+
+    async def _crawl(self, task: Task, host: str):
+        try:
+            result = await crawl_with_timeout(task)
+            await self.results.put(result)
+        finally:
+            host_breaker.finish(host, task.task_id)
+            self.running.pop(task.task_id, None)
+            self.host_running[host] -= 1
+            if not self.host_running[host]:
+                self.host_running.pop(host, None)
+            self._wakeup.set()
+
+    async def _write_loop(self):
+        while True:
+            results = [await self.results.get()]
+            # collect the results arrived in a short window, save them in one transaction
+            deadline = time() + Config.crawl_result_batch_interval
+            while len(results) < Config.crawl_result_batch_size:
+                if not self.results.empty():
+                    results.append(self.results.get_nowait())
+                    continue
+                timeout = deadline - time()
+                if timeout <= 0:
+                    break
+                try:
+                    results.append(await wait_for(self.results.get(),
+                                                  timeout=timeout))
+                except TimeoutError:
+                    break
+            await try_catch(save_crawl_results, results)
+
+    async def close(self):
+        for future in self._futures:
+            future.cancel()
+        for future in list(self.running.values()):
+            future.cancel()
+        self.host_queues.clear()
+        self.groups.clear()
+        self.hosts.clear()
+        self.queued.clear()
+        results = []
+        while self.results and not self.results.empty():
+            results.append(self.results.get_nowait())
+        if results:
+            await try_catch(save_crawl_results, results)
+
+
+engine = CrawlEngine()
+
+
+async def lease_tasks(condition: str, values: dict, now: datetime):
+    """Claim the due tasks of the condition with a conditional update, so each due
+    task is crawled by only one worker. Return the query and values of the
+    claimed tasks and the candidate task_ids.
+
+    condition may end with the limit clause, so the lease filter goes first."""
+    db: Database = Config.db
+    values = dict(values, now=now)
+    rows = await db.fetch_all(
+        query=f'select `task_id` from tasks where `lease_until`<:now and {condition}',
+        values=values)
+    candidate_ids = tuple(row.task_id for row in rows)
+    if not candidate_ids:
+        return None, None, candidate_ids
+    # some db drops the microseconds of TIMESTAMP
+    lease_until = (now + timedelta(seconds=Config.lease_seconds)).replace(
+        microsecond=0)
+    lease_values = {'lease_owner': Config.worker_id, 'lease_until': lease_until}
+    await db.execute(query=get_in_sql(LEASE_TASKS_QUERY, len(candidate_ids)),
+                     values=get_in_values(candidate_ids,
+                                          dict(lease_values, now=now)))
+    query = get_in_sql(SELECT_LEASED_TASKS_QUERY, len(candidate_ids))
+    return query, get_in_values(candidate_ids, lease_values), candidate_ids
+
+
+async def release_leases(task_ids: List[int]):
+    if not Config.lease_tasks or not task_ids:
+        return
+    query = 'update tasks set `lease_until`=:lease_until where `task_id`=:task_id and `lease_owner`=:lease_owner'
+    await Config.db.execute_many(query=query,
+                                 values=[{
+                                     'task_id': task_id,
+                                     'lease_owner': Config.worker_id,
+                                     'lease_until': date0
+                                 } for task_id in task_ids])
+
+
+async def ramp_due_tasks():
+    """Spread the overdue tasks across Config.startup_ramp_seconds on startup, such
+    as the new tasks with next_check_time 1970-01-01, instead of crawling them at once."""
+    ramp = Config.startup_ramp_seconds
+    if ramp <= 0:
+        return
     db: Database = Config.db
     now = datetime.now()
+    query = tasks.select().with_only_columns(
+        tasks.c.task_id).where(tasks.c.enable == 1).where(
+            tasks.c.next_check_time <= now)
+    rows = await db.fetch_all(query=query)
+    if not rows:
+        return
+    values = [{
+        'task_id': row.task_id,
+        'next_check_time': now + timedelta(
+            seconds=get_task_phase(row.task_id) * ramp),
+        'now': now,
+    } for row in rows]
+    # skip the tasks crawled by the other workers in the meantime
+    query = 'update tasks set `next_check_time`=:next_check_time where `task_id`=:task_id and `next_check_time`<=:now'
+    await db.execute_many(query=query, values=values)
+    Config.logger.info(
+        f'[Scheduler] {len(values)} overdue tasks spread across {ramp} seconds.')
+
+
+async def get_load_histogram(seconds: int = 3600,
+                             bucket: int = 1) -> Dict[str, Any]:
+    """Expected crawls of each bucket seconds in the coming seconds, projected
+    by next_check_time and interval of the enabled tasks."""
+    seconds = max(min(seconds, 86400), 1)
+    bucket = max(bucket, 1)
+    now = datetime.now()
+    query = tasks.select().with_only_columns(
+        tasks.c.next_check_time, tasks.c.interval).where(tasks.c.enable == 1)
+    # interval: the first offsets of the tasks
+    firsts: Dict[int, List[int]] = defaultdict(list)
+    for row in await Config.db.fetch_all(query=query):
+        offset = int(max((row.next_check_time - now).total_seconds(), 0))
+        if offset < seconds:
+            firsts[max(row.interval or 0, 1)].append(offset)
+    per_second = [0] * seconds
+    for interval, offsets in firsts.items():
+        residues = min(interval, seconds)
+        if len(offsets) * (seconds // interval + 1) <= residues:
+            # fewer crawls than the residues
+            for offset in offsets:
+                for second in range(offset, seconds, interval):
+                    per_second[second] += 1
+            continue
+        starts = [0] * seconds
+        for offset in offsets:
+            starts[offset] += 1
+        # the crawls of second t = the starts of t, t - interval, t - 2 * interval...
+        for residue in range(residues):
+            per_second[residue::interval] = map(
+                add, per_second[residue::interval],
+                accumulate(starts[residue::interval]))
+    counts = [
+        sum(per_second[index:index + bucket])
+        for index in range(0, seconds, bucket)
+    ]
+    return {
+        'start': now,
+        'seconds': seconds,
+        'bucket': bucket,
+        'max': max(counts),
+        'mean': sum(counts) / len(counts),
+        'counts': counts,
+    }
+
+
+async def _crawl_once(task_name: Optional[str] = None,
+                      chunk_size: Optional[int] = None,
+                      task_ids: Optional[Tuple[int, ...]] = None):
+    """task_name means force crawl, task_ids are given by the scheduler"""
+    db: Database = Config.db
     logger = Config.logger
     logger.info(f'crawl_once task_name={task_name} start.')
+    chunk_size = chunk_size or Config.crawl_concurrency
+    if not task_name:
+        # wait for the free slots of the crawl engine
+        await engine.wait_for_space()
+    now = datetime.now()
     # sqlite do not has datediff...
+    # raw sql of the same shape, reuses the prepared statements
     if task_name:
-        query = tasks.select().where(tasks.c.name == task_name)
+        condition, limit = '`name`=:name', ''
+        values = {'name': task_name}
+    elif task_ids:
+        condition = get_in_sql('`enable`=1 and `task_id` in (:ids)',
+                               len(task_ids))
+        limit, values = '', get_in_values(task_ids)
     else:
-        query = tasks.select().where(tasks.c.enable == 1).where(
-            tasks.c.next_check_time <= now)
-        query = query.limit(chunk_size)
+        condition = '`enable`=1 and `next_check_time`<=:now'
+        limit, values = ' limit :limit', {'now': now, 'limit': chunk_size}
+    if Config.lease_tasks and not task_name:
+        query, values, candidate_ids = await lease_tasks(
+            condition + limit, values, now)
+        has_more = len(candidate_ids) >= chunk_size
+    else:
+        query = f'select * from tasks where {condition}{limit}'
+    fetched_tasks = await db.fetch_all(query=query,
+                                       values=values) if query else []
+    if not Config.lease_tasks or task_name:
+        has_more = len(fetched_tasks) >= chunk_size
+    elif task_ids and Config.scheduler:
+        # leased by the other workers, check them later
+        claimed_ids = {row.task_id for row in fetched_tasks}
+        await Config.scheduler.refresh_many(
+            [task_id for task_id in task_ids if task_id not in claimed_ids],
+            now + timedelta(seconds=Config.check_interval))
     todo = []
-    now = datetime.now()
     update_values = []
-    CLEAR_CACHE_NEEDED = False
-    fetched_tasks = await db.fetch_all(query=query)
-    has_more = len(fetched_tasks) >= chunk_size
+    update_tasks = []
+    release_ids = []
+    if Config.adaptive_interval:
+        await change_history.load([row.task_id for row in fetched_tasks])
     for _task in fetched_tasks:
         task = Task(**dict(_task))
+        if Config.lease_tasks:
+            # the other workers may have saved new keys since the last lease
+            result_keys_cache.remove(task.task_id)
+        if not task_name and engine.is_pending(task.task_id):
+            # still crawling
+            if Config.scheduler and task.enable:
+                Config.scheduler.push(
+                    task.task_id,
+                    now + timedelta(seconds=Config.check_interval))
+            continue
         # check work hours
         need_crawl, next_check_time = find_next_check_time(task, now)
         if task_name:
             # always crawl for given task_name
             need_crawl = True
         if need_crawl:
-            t = ensure_future(crawl(task))
-            # add task_name for logger
-            setattr(t, 'task_name', task.name)
-            todo.append(t)
+            todo.append(task)
         # update next_check_time
         values = {
             'last_check_time': now,
@@ -186,140 +1284,58 @@ async def _crawl_once(task_name: Optional[str] = None, chunk_size: int = 20):
         # update task variable for callback
         task.__dict__.update(values)
         update_values.append(values)
+        update_tasks.append(task)
+        if Config.scheduler and task.enable:
+            Config.scheduler.push(task.task_id, next_check_time)
         if not need_crawl:
+            release_ids.append(task.task_id)
             logger.info(
                 f'Task [{task.name}] is not on work time, next_check_time reset to {next_check_time}'
             )
     update_query = 'update tasks set `last_check_time`=:last_check_time,`next_check_time`=:next_check_time where task_id=:task_id'
-    await db.execute_many(query=update_query, values=update_values)
     if update_values:
-        CLEAR_CACHE_NEEDED = True
-    logger.info(f'crawl_once crawling {len(todo)} valid tasks.')
-    if todo:
-        crawl_errors = []
-        done, pending = await wait(todo, timeout=Config.default_crawler_timeout)
-        if pending:
-            names = [getattr(t, 'task_name', None) for t in pending]
-            logger.error(f'crawl timeout {len(names)}: {names}')
-            for _pending in pending:
-                crawl_errors.append({
-                    'task_id': task.task_id,
-                    'error': 'timeout(%s)' % Config.default_crawler_timeout
-                })
-                _pending.cancel()
-        ttime_now = ttime()
-        changed_tasks = []
-        update_counts = 0
-        for t in done:
-            task, error, result_list = t.result()
-            if error != task.error:
-                crawl_errors.append({'task_id': task.task_id, 'error': error})
-            if error or result_list is None:
-                # ignore update this task
-                continue
-            # compare latest_result and new list
-            # later first, just like the saved result_list sortings
-            old_latest_result = loads(task.latest_result)
-            # try to use the key, or it self
-            try:
-                old_result_list = loads(
-                    task.result_list) if task.result_list else []
-            except JSONDecodeError:
-                old_result_list = []
-            if old_latest_result.get('unique', True):
-                # unique mode will skip all the Duplicated results
-                exist_keys = {
-                    get_result_key(_old_result['result'])
-                    for _old_result in old_result_list
-                }
-            else:
-                old_latest_result_key = get_result_key(old_latest_result)
-                exist_keys = {old_latest_result_key}
-            # list of dict
-            to_insert_result_list = []
-            for result in result_list:
-                result_key = get_result_key(result)
-                if result_key in exist_keys:
-                    break
-                to_insert_result_list.append(result)
-            if to_insert_result_list:
-                # update db
-                update_counts += 1
-                # new result updated
-                query = UpdateTaskQuery(task.task_id)
-                # JSON
-                new_latest_result = dumps(to_insert_result_list[0],
-                                          sort_keys=True)
-                query.add('latest_result', new_latest_result)
-                query.add('last_change_time', now)
-                # older insert first, keep the newer is on the top
-                new_seeds = []
-                for result in to_insert_result_list[::-1]:
-                    # result is dict, not json string
-                    old_result_list.insert(0, {
-                        'result': result,
-                        'time': ttime_now
-                    })
-                    new_seeds.append(result)
-                await save_feed(new_seeds, db, task)
-                new_result_list = dumps(old_result_list[:task.max_result_count])
-                query.add('result_list', new_result_list)
-                logger.info(f'[Updated] {task.name}. +++')
-                await db.execute(**query.kwargs)
-                task.latest_result = new_latest_result
-                task.last_change_time = now
-                task.result_list = new_result_list
-                changed_tasks.append(task)
-        if crawl_errors:
-            update_query = 'update tasks set `error`=:error where task_id=:task_id'
-            await db.execute_many(query=update_query, values=crawl_errors)
-        logger.info(
-            f'Crawl task_name={task_name} finished. Crawled: {len(done)}, Error: {len(crawl_errors)}, Timeout: {len(pending)}, Update: {update_counts}.{" +++" if update_counts else ""}'
-        )
-        for task in changed_tasks:
-            ensure_future(try_catch(Config.callback_handler.callback, task))
-        query_feeds.cache_clear()
-    else:
-        logger.info(f'Crawl task_name={task_name} finished. 0 todo.')
-    if CLEAR_CACHE_NEEDED:
-        logger.info('Clear cache for crawling new tasks.')
-        query_tasks.cache_clear()
+        async with db.transaction():
+            await db.execute_many(query=update_query, values=update_values)
+            await release_leases(release_ids)
+        # only query_tasks returns the check times
+        invalidate_task(*update_tasks, caches=[query_tasks])
     if task_name:
+        for task in todo:
+            # force crawl ignores the validators
+            await save_crawl_results(
+                [await crawl_with_timeout(task, conditional=False)])
         query = tasks.select().where(tasks.c.name == task_name)
         _task = await db.fetch_one(query=query)
         return dict(_task)
-    else:
-        return has_more
+    if Config.conditional_crawl:
+        await validators_cache.load([task.task_id for task in todo])
+    for task in todo:
+        engine.submit(task)
+    logger.info(
+        f'crawl_once submitted {len(todo)} valid tasks, running: {len(engine.running)}, queued: {len(engine.queued)}.'
+    )
+    return has_more
 
 
-async def crawl_once(task_name: Optional[str] = None):
+async def crawl_once(task_name: Optional[str] = None,
+                     task_ids: Optional[Tuple[int, ...]] = None):
     if task_name is not None:
         return await _crawl_once(task_name)
     with solo:
-        result = await try_catch(_crawl_once, task_name)
+        result = await try_catch(_crawl_once, task_name, task_ids=task_ids)
         return result
 
 
-async def save_feed(new_seeds, db, task):
-    if not new_seeds:
-        return
-    try:
-        values = []
-        for result in new_seeds:
-            value = {
-                'task_id': task.task_id,
-                'name': task.name,
-                'text': result.get('title') or result.get('text') or '',
-                'url': result.get('url') or task.origin_url,
-                'ts_create': datetime.now(),
-            }
-            values.append(value)
-
-        query = "INSERT INTO feeds (`task_id`, `name`, `text`, `url`, `ts_create`) values (:task_id, :name, :text, :url, :ts_create)"
-        result = await db.execute_many(query=query, values=values)
-        Config.logger.info(
-            f'Insert task seeds success({task.name}): ({len(values)})')
-        return result
-    except Exception:
-        Config.logger.error(
-            f'Inserting task seeds failed({task.name}): {format_exc()}')
+def get_feed_values(new_seeds, task, now=None):
+    now = now or datetime.now()
+    values = []
+    for result in new_seeds:
+        value = {
+            'task_id': task.task_id,
+            'name': task.name,
+            'text': result.get('title') or result.get('text') or '',
+            'url': result.get('url') or task.origin_url,
+            'ts_create': now,
+        }
+        values.append(value)
+    return values
@@ -37,18 +37,8 @@ def init_app(db_url=None,
     if uninstall:
         clear_dir(Config.CONFIG_DIR)
         sys.exit('Config dir cleared.')
-    if allow_new_request:
-        # will allow use requests / aiohttp / tPool / Requests in UDFParser
-        import aiohttp
-        import requests
-        from torequests.dummy import Requests
-        from torequests.main import tPool
-        from uniparser.parsers import UDFParser
-
-        UDFParser._GLOBALS_ARGS.update(aiohttp=aiohttp,
-                                       requests=requests,
-                                       Requests=Requests,
-                                       tPool=tPool)
+    # will allow use requests / aiohttp / tPool / Requests in UDFParser
+    Config.allow_new_request = allow_new_request
     # backward compatibility for ignore_stdout_log & ignore_file_log
     Config.mute_std_log = get_valid_value(
         [uvicorn_kwargs.pop('ignore_stdout_log', NotSet), mute_std_log],
@@ -0,0 +1,148 @@
+from datetime import datetime
+from json import JSONDecodeError, dumps, loads
+from typing import Callable, List, Tuple
+
+import sqlalchemy
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import text
+
+from .config import Config
+from .models import feeds, metas, results, tasks
+
+SCHEMA_VERSION_KEY = 'schema_version'
+# (version, description, function(conn)), the functions should be idempotent,
+# for the new databases created by the newer create_all.
+migrations: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: int, description: str):
+    """Register a schema migration, versions should be increasing."""
+
+    def wrapper(function):
+        assert not migrations or migrations[-1][0] < version
+        migrations.append((version, description, function))
+        return function
+
+    return wrapper
+
+
+def get_column_names(conn: Connection, table: sqlalchemy.Table) -> set:
+    return {
+        column['name']
+        for column in sqlalchemy.inspect(conn).get_columns(table.name)
+    }
+
+
+def add_column(conn: Connection, column: sqlalchemy.Column):
+    table = column.table
+    column_spec = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_spec}'))
+    Config.logger.warning(f'Column {column.name} added into table {table.name}.')
+
+
+def add_missing_columns(conn: Connection, table: sqlalchemy.Table):
+    """create_all will not add the new columns into the exist tables."""
+    exist_columns = get_column_names(conn, table)
+    for column in table.columns:
+        if column.name not in exist_columns:
+            add_column(conn, column)
+
+
+def add_missing_indexes(conn: Connection, table: sqlalchemy.Table):
+    """create_all will not add the new indexes into the exist tables."""
+    exist_indexes = {
+        index['name'] for index in sqlalchemy.inspect(conn).get_indexes(table.name)
+    }
+    for index in table.indexes:
+        if index.name in exist_indexes:
+            continue
+        Config.logger.warning(
+            f'Creating index {index.name} on table {table.name}, may take a while for the large tables.'
+        )
+        index.create(bind=conn)
+
+
+def get_schema_version(conn: Connection) -> int:
+    query = metas.select().with_only_columns(
+        metas.c.value).where(metas.c.key == SCHEMA_VERSION_KEY)
+    value = conn.execute(query).scalar()
+    return int(value or 0)
+
+
+def set_schema_version(conn: Connection, version: int):
+    conn.execute(
+        metas.delete().where(metas.c.key == SCHEMA_VERSION_KEY))
+    conn.execute(metas.insert().values(key=SCHEMA_VERSION_KEY,
+                                       value=str(version)))
+
+
+@migration(1, 'add the lease columns of tasks')
+def add_task_columns(conn: Connection):
+    # the tables columns of that time, the later columns have their own migrations
+    exist_columns = get_column_names(conn, tasks)
+    for column in (tasks.c.lease_owner, tasks.c.lease_until):
+        if column.name not in exist_columns:
+            add_column(conn, column)
+
+
+@migration(2, 'move tasks.result_list into the results table')
+def migrate_result_list(conn: Connection):
+    query = tasks.select().with_only_columns(
+        tasks.c.task_id, tasks.c.result_list,
+        tasks.c.last_change_time).where(tasks.c.result_list.isnot(None))
+    rows = conn.execute(query).fetchall()
+    values = []
+    for row in rows:
+        try:
+            result_list = loads(row.result_list or '[]')
+        except JSONDecodeError:
+            result_list = []
+        # newer first
+        for item in result_list[::-1]:
+            try:
+                time = datetime.strptime(item['time'], '%Y-%m-%d %H:%M:%S')
+            except (KeyError, TypeError, ValueError):
+                time = row.last_change_time
+            values.append({
+                'task_id': row.task_id,
+                'result': dumps(item.get('result', {})),
+                'time': time
+            })
+    if values:
+        conn.execute(results.insert(), values)
+    conn.execute(
+        tasks.update().where(tasks.c.result_list.isnot(None)).values(
+            result_list=None))
+    # the flag of the old one-shot migration, replaced by the schema version
+    conn.execute(metas.delete().where(metas.c.key == 'result_list_migrated'))
+    if rows:
+        Config.logger.warning(
+            f'Migrated {len(values)} results of {len(rows)} tasks into the results table.'
+        )
+
+
+@migration(3, 'add the indexes of the scheduler and feeds queries')
+def add_query_indexes(conn: Connection):
+    add_missing_indexes(conn, tasks)
+    add_missing_indexes(conn, feeds)
+
+
+@migration(4, 'add the failures column of tasks')
+def add_task_failures(conn: Connection):
+    if tasks.c.failures.name not in get_column_names(conn, tasks):
+        add_column(conn, tasks.c.failures)
+
+
+def migrate(engine: Engine):
+    """Run the pending migrations, each one in its own transaction with the new version."""
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+    for version, description, function in migrations:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            function(conn)
+            set_schema_version(conn, version)
+        Config.logger.warning(
+            f'Database migrated to version {version}: {description}.')
@@ -1,7 +1,9 @@
 import re
 from datetime import datetime
+from json import dumps, loads
+from time import time
 from traceback import format_exc
-from typing import Iterable, List, Optional, Set, Tuple, Union
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import sqlalchemy
 from async_lru import alru_cache
@@ -12,6 +14,7 @@ from uniparser import CrawlerRule, HostRule
 from uniparser.crawler import RuleStorage, get_host
 
 from .config import Config
+from .utils import DependentCache, dependent_cache, to_datetime
 
 if Config.COLLATION is None:
     if Config.db_url.startswith('sqlite'):
@@ -63,7 +66,8 @@ tasks = sqlalchemy.Table(
                       server_default=text('10'),
                       nullable=False),
     sqlalchemy.Column("latest_result", sqlalchemy.TEXT),
-    sqlalchemy.Column("result_list", sqlalchemy.TEXT),  # JSON list
+    # JSON list, deprecated, the history is saved in the results table
+    sqlalchemy.Column("result_list", sqlalchemy.TEXT),
     sqlalchemy.Column("last_check_time",
                       sqlalchemy.TIMESTAMP,
                       server_default="1970-01-01 08:00:00",
@@ -79,6 +83,23 @@ tasks = sqlalchemy.Table(
                       nullable=False),
     sqlalchemy.Column("custom_info",
                       sqlalchemy.TEXT(collation=Config.COLLATION)),
+    # the worker who is crawling this task, see Config.lease_tasks
+    sqlalchemy.Column("lease_owner",
+                      sqlalchemy.String(64),
+                      server_default="",
+                      nullable=False),
+    sqlalchemy.Column("lease_until",
+                      sqlalchemy.TIMESTAMP,
+                      server_default="1970-01-01 08:00:00",
+                      nullable=False),
+    # consecutive crawl errors, for the backoff of next_check_time
+    sqlalchemy.Column("failures",
+                      sqlalchemy.Integer,
+                      server_default=text('0'),
+                      nullable=False),
+    # for the scheduler queries of the enabled and due tasks
+    sqlalchemy.Index('ix_tasks_enable_next_check_time', 'enable',
+                     'next_check_time'),
 )
 host_rules = sqlalchemy.Table(
     "host_rules",
@@ -115,6 +136,45 @@ feeds = sqlalchemy.Table(
                       nullable=False,
                       server_default=""),
     sqlalchemy.Column("ts_create", sqlalchemy.TIMESTAMP, nullable=False),
+    # query_feeds filters by task_id and orders by id
+    sqlalchemy.Index('ix_feeds_task_id_id', 'task_id', 'id'),
+    sqlalchemy.Index('ix_feeds_ts_create', 'ts_create'),
+)
+results = sqlalchemy.Table(
+    "results",
+    metadata,
+    sqlalchemy.Column('id',
+                      sqlalchemy.Integer,
+                      primary_key=True,
+                      autoincrement=True),
+    sqlalchemy.Column('task_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("result", sqlalchemy.TEXT),  # JSON
+    sqlalchemy.Column("time", sqlalchemy.TIMESTAMP, nullable=False),
+    sqlalchemy.Index('ix_results_task_id_time', 'task_id', 'time'),
+)
+result_keys = sqlalchemy.Table(
+    "result_keys",
+    metadata,
+    sqlalchemy.Column('id',
+                      sqlalchemy.Integer,
+                      primary_key=True,
+                      autoincrement=True),
+    sqlalchemy.Column('task_id', sqlalchemy.Integer, nullable=False),
+    # signed 64-bit hash of get_result_key
+    sqlalchemy.Column("key_hash", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.UniqueConstraint('task_id',
+                                'key_hash',
+                                name='uq_result_keys_task_id_key_hash'),
+)
+validators = sqlalchemy.Table(
+    "validators",
+    metadata,
+    sqlalchemy.Column('task_id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('etag', sqlalchemy.String(256)),
+    sqlalchemy.Column('last_modified', sqlalchemy.String(64)),
+    sqlalchemy.Column('body_hash', sqlalchemy.String(32)),
+    # hash of the crawler rule and request_args, the body_hash is invalid if changed
+    sqlalchemy.Column('rule_hash', sqlalchemy.String(32)),
 )
 groups = sqlalchemy.Table(
     "groups",
@@ -134,22 +194,96 @@ groups = sqlalchemy.Table(
 def create_tables(db_url):
     try:
         engine = sqlalchemy.create_engine(db_url)
+        if db_url.startswith('sqlite') and not sqlalchemy.inspect(
+                engine).get_table_names():
+            # only works before creating tables, for the incremental vacuum of feeds retention
+            with engine.connect() as conn:
+                conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
         metadata.create_all(engine)
+        from .migrations import migrate
+        migrate(engine)
     except BaseException:
         Config.logger.critical(f'Fatal error on creating Table: {format_exc()}')
         import os
         os._exit(1)
 
 
+def copy_rule(rule: CrawlerRule) -> CrawlerRule:
+    """Shallow copy of the cached rule with its own context, which is written by
+    each crawl (resp, request_args), the compiled parse rules are shared."""
+    new_rule = CrawlerRule.__new__(CrawlerRule)
+    dict.update(new_rule, rule)
+    new_rule.context = dict(rule.context)
+    return new_rule
+
+
+class CachedHostRule:
+    """HostRule loaded from db with the precompiled regex of its crawler rules,
+    host_rule is None for the host without rules."""
+    __slots__ = ('host_rule', 'patterns', 'expire')
+
+    def __init__(self, host_rule: Optional[HostRule], expire: float = 0):
+        self.host_rule = host_rule
+        self.expire = expire
+        self.patterns = []
+        if host_rule:
+            for rule in host_rule['crawler_rules'].values():
+                # empty regex matches all, the same as CrawlerRule.match
+                pattern = re.compile(rule['regex']) if rule['regex'] else None
+                self.patterns.append((pattern, rule))
+
+    def find(self, url) -> Optional[CrawlerRule]:
+        rules = [
+            rule for pattern, rule in self.patterns
+            if pattern is None or pattern.match(url)
+        ]
+        if len(rules) > 1:
+            raise ValueError(f'{url} matched more than 1 rule. {rules}')
+        if rules:
+            return copy_rule(rules[0])
+
+
 class RuleStorageDB(RuleStorage):
 
     def __init__(self, db):
         self.db = db
         self.logger = Config.logger
+        # host: CachedHostRule, invalidated by the add / pop methods
+        self.cache: Dict[str, CachedHostRule] = {}
 
     async def commit(self):
         pass
 
+    def get_cache_expire(self) -> float:
+        if Config.host_rule_cache_ttl > 0:
+            return time() + Config.host_rule_cache_ttl
+        return 0
+
+    async def prewarm(self):
+        """Load all the host rules into the cache."""
+        rows = await self.db.fetch_all(
+            query="SELECT host, host_rule FROM host_rules")
+        expire = self.get_cache_expire()
+        self.cache = {
+            row.host: CachedHostRule(HostRule.loads(row.host_rule), expire)
+            for row in rows
+        }
+        self.logger.info(f'[Rule] {len(self.cache)} host rules cached.')
+
+    def invalidate(self, host: Optional[str] = None):
+        if host is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(host, None)
+
+    async def get_cached_host_rule(self, host: str) -> CachedHostRule:
+        cached = self.cache.get(host)
+        if cached is None or (cached.expire and cached.expire < time()):
+            host_rule = await self.get_host_rule(host)
+            cached = CachedHostRule(host_rule, self.get_cache_expire())
+            self.cache[host] = cached
+        return cached
+
     async def get_host_rule(self, host: str, default=None):
         query = "SELECT host_rule FROM host_rules WHERE host = :host"
         host_rule = await self.db.fetch_one(query=query, values={"host": host})
@@ -162,9 +296,8 @@ class RuleStorageDB(RuleStorage):
         if not url:
             return None
         host = get_host(url)
-        host_rule = await self.get_host_rule(host)
-        if host_rule:
-            return host_rule.find(url)
+        cached = await self.get_cached_host_rule(host)
+        return cached.find(url)
 
     async def add_crawler_rule(self, rule: CrawlerRule, commit=None):
         if isinstance(rule, str):
@@ -184,22 +317,21 @@ class RuleStorageDB(RuleStorage):
         if exist_host_rule:
             exist_host_rule.add_crawler_rule(rule)
             query = "update host_rules set host_rule=:host_rule_string WHERE host = :host"
-            return await self.db.execute(
-                query=query,
-                values={
-                    'host_rule_string': exist_host_rule.dumps(),
-                    'host': host
-                })
+            host_rule_string = exist_host_rule.dumps()
         else:
             host_rule = HostRule(host)
             host_rule.add_crawler_rule(rule)
             query = "INSERT INTO host_rules (host, host_rule) values (:host, :host_rule_string)"
-            return await self.db.execute(
-                query=query,
-                values={
-                    'host_rule_string': host_rule.dumps(),
-                    'host': host
-                })
+            host_rule_string = host_rule.dumps()
+        try:
+            return await self.db.execute(query=query,
+                                         values={
+                                             'host_rule_string':
+                                                 host_rule_string,
+                                             'host': host
+                                         })
+        finally:
+            self.invalidate(host)
 
     async def pop_crawler_rule(self, rule: CrawlerRule, commit=False):
         query = "SELECT host_rule FROM host_rules"
@@ -224,18 +356,16 @@ class RuleStorageDB(RuleStorage):
         exist_host_rule = await self.get_host_rule(rule['host'])
         if exist_host_rule:
             query = "update host_rules set host_rule=:host_rule_string WHERE host = :host"
-            return await self.db.execute(query=query,
-                                         values={
-                                             'host_rule_string': rule.dumps(),
-                                             'host': rule['host']
-                                         })
         else:
             query = "INSERT INTO host_rules (host, host_rule) values (:host, :host_rule_string)"
+        try:
             return await self.db.execute(query=query,
                                          values={
                                              'host_rule_string': rule.dumps(),
                                              'host': rule['host']
                                          })
+        finally:
+            self.invalidate(rule['host'])
 
     async def pop_host_rule(self, host: str, commit=None):
         exist_host_rule = await self.get_host_rule(host)
@@ -243,6 +373,7 @@ class RuleStorageDB(RuleStorage):
         if host_rule:
             query = "delete FROM host_rules WHERE host = :host"
             await self.db.execute(query=query, values={'host': host})
+            self.invalidate(host)
         return host_rule
 
 
@@ -258,11 +389,13 @@ class Task(BaseModel):
     work_hours: str = '0, 24'
     max_result_count: int = 30
     latest_result: str = '{}'
-    result_list = '[]'
+    # deprecated, only for adding the history of new task
+    result_list: Optional[str] = None
     last_check_time: datetime = date0
     next_check_time: datetime = date0
     last_change_time: datetime = date0
     custom_info: str = ''
+    failures: int = 0
 
 
 class Group(BaseModel):
@@ -321,7 +454,93 @@ class Metas(object):
         self._get.cache_clear()
 
 
-@alru_cache(maxsize=Config.query_tasks_cache_maxsize)
+def log_query(message: str, query):
+    """Rendering the query with literal binds is expensive, only if Config.log_sql."""
+    if Config.log_sql:
+        query_string = str(
+            query.compile(compile_kwargs={"literal_binds": True})).replace(
+                '\n', '')
+        message = f'{message}: {query_string}'
+    Config.logger.info(message)
+
+
+def get_task_query_deps(task_name: Optional[str] = None,
+                        task_id: Optional[int] = None,
+                        tag: str = '',
+                        task_ids: Tuple[int] = None,
+                        **kwargs) -> Set[tuple]:
+    """Dependency keys of the query_* caches, the same priority as the where clauses."""
+    if task_ids:
+        return {('task', task_id) for task_id in task_ids}
+    if task_id is not None:
+        return {('task', task_id)}
+    if task_name is not None:
+        return {('name', task_name)}
+    if tag:
+        return {('tag', tag)}
+    return {('all',)}
+
+
+def invalidate_task(*tasks: Union[dict, BaseModel, None],
+                    caches: Optional[List[DependentCache]] = None):
+    """Evict the cached queries which may contain the given tasks, the given tasks
+    should contain the old ones if the name / tag changed. caches defaults to
+    all the task_caches."""
+    deps = {('all',)}
+    for task in tasks:
+        if task is None:
+            continue
+        if isinstance(task, BaseModel):
+            task = dict(task)
+        deps.add(('task', task.get('task_id')))
+        deps.add(('name', task.get('name')))
+        deps.add(('tag', task.get('tag')))
+    for cache in task_caches if caches is None else caches:
+        cache.invalidate(*deps)
+
+
+def get_keyset_clause(columns: list, values: tuple, desc: bool):
+    """Rows after the cursor values in the order of the columns, the last column should be unique."""
+    clauses = []
+    for index, column in enumerate(columns):
+        value = values[index]
+        clause = column < value if desc else column > value
+        equals = [c == v for c, v in zip(columns[:index], values[:index])]
+        clauses.append(sqlalchemy.and_(*equals, clause))
+    return sqlalchemy.or_(*clauses)
+
+
+def get_sort_desc(sort: str) -> bool:
+    if sort.lower() == 'desc':
+        return True
+    elif sort.lower() == 'asc':
+        return False
+    else:
+        raise ValueError(
+            f"bad sort arg {sort} not in ('desc', 'asc', 'DESC', 'ASC')")
+
+
+def dump_task_cursor(task: dict, order_by: str = 'last_change_time') -> str:
+    return f'{task[order_by]},{task["task_id"]}'
+
+
+def load_task_cursor(cursor: str,
+                     order_by: str = 'last_change_time') -> Optional[tuple]:
+    """Cursor string to the hashable (order_by value, task_id)."""
+    if not cursor:
+        return None
+    value, _, task_id = cursor.rpartition(',')
+    column = getattr(tasks.c, order_by, None)
+    if column is None:
+        raise ValueError(f'bad order_by {order_by}')
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return to_datetime(value), int(task_id)
+    return python_type(value), int(task_id)
+
+
+@dependent_cache(maxsize=Config.query_tasks_cache_maxsize,
+                 get_deps=get_task_query_deps)
 async def query_tasks(
     task_name: Optional[str] = None,
     task_id: Optional[int] = None,
@@ -331,7 +550,12 @@ async def query_tasks(
     sort: str = 'desc',
     tag: str = '',
     task_ids: Tuple[int] = None,
+    after: Optional[tuple] = None,
+    before: Optional[tuple] = None,
 ) -> Tuple[List[dict], bool]:
+    """after / before: the cursor (order_by value, task_id) of load_task_cursor,
+    query the rows after / before it in the sort order without OFFSET.
+    has_more means more rows before the result while querying with before."""
     # task_ids arg type is tuple for cache hashing
     offset = page_size * (page - 1)
     query = tasks.select()
@@ -344,30 +568,33 @@ async def query_tasks(
             query = query.where(tasks.c.name == task_name)
         if tag:
             query = query.where(tasks.c.tag == tag)
+    cursor = after or before
+    reverse = not after and bool(before)
     if order_by and sort:
         ob = getattr(tasks.c, order_by, None)
         if ob is None:
             raise ValueError(f'bad order_by {order_by}')
-        if sort.lower() == 'desc':
-            ob = sqlalchemy.desc(ob)
-        elif sort.lower() == 'asc':
-            ob = sqlalchemy.asc(ob)
-        else:
-            raise ValueError(
-                f"bad sort arg {sort} not in ('desc', 'asc', 'DESC', 'ASC')")
-        query = query.order_by(ob)
+        desc = get_sort_desc(sort) != reverse
+        columns = [ob, tasks.c.task_id]
+        if cursor:
+            offset = 0
+            query = query.where(get_keyset_clause(columns, cursor, desc))
+        order = sqlalchemy.desc if desc else sqlalchemy.asc
+        query = query.order_by(*[order(column) for column in columns])
+    elif cursor:
+        raise ValueError('cursor pagination requires order_by and sort')
     query = query.limit(page_size + 1).offset(offset)
     _result = await Config.db.fetch_all(query=query)
     has_more = len(_result) > page_size
     result = [dict(i) for i in _result][:page_size]
-    query_string = str(query.compile(
-        compile_kwargs={"literal_binds": True})).replace('\n', '')
-    Config.logger.info(
-        f'[Query] {len(result)} tasks (has_more={has_more}): {query_string}')
+    if reverse:
+        result.reverse()
+    log_query(f'[Query] {len(result)} tasks (has_more={has_more})', query)
     return result, has_more
 
 
-@alru_cache(maxsize=Config.query_task_ids_cache_maxsize)
+@dependent_cache(maxsize=Config.query_task_ids_cache_maxsize,
+                 get_deps=get_task_query_deps)
 async def query_task_ids(task_name: Optional[str] = None,
                          tag: str = '') -> List[int]:
     query = tasks.select()
@@ -377,9 +604,7 @@ async def query_task_ids(task_name: Optional[str] = None,
         query = query.where(tasks.c.tag == tag)
     _result = await Config.db.fetch_all(query=query)
     result = [dict(i)['task_id'] for i in _result]
-    query_string = str(query.compile(
-        compile_kwargs={"literal_binds": True})).replace('\n', '')
-    Config.logger.info(f'[Query] {len(result)} task ids: {query_string}')
+    log_query(f'[Query] {len(result)} task ids', query)
     return result
 
 
@@ -406,15 +631,14 @@ async def query_group_task_ids(
             task_ids_str = dict(_result).get('task_ids') or ''
             for task_id in re.findall(r'\d+', task_ids_str):
                 task_ids.add(int(task_id))
-    query_string = str(query.compile(
-        compile_kwargs={"literal_binds": True})).replace('\n', '')
-    Config.logger.info(
-        f'[Query] {len(task_ids)} task_ids by group {group_id or group_ids}: {query_string}'
-    )
+    log_query(
+        f'[Query] {len(task_ids)} task_ids by group {group_id or group_ids}',
+        query)
     return list(task_ids)
 
 
-@alru_cache(maxsize=Config.query_feeds_cache_maxsize)
+@dependent_cache(maxsize=Config.query_feeds_cache_maxsize,
+                 get_deps=get_task_query_deps)
 async def query_feeds(
     task_name: Optional[str] = None,
     task_id: Optional[int] = None,
@@ -424,7 +648,11 @@ async def query_feeds(
     sort: str = 'desc',
     tag: str = '',
     task_ids: Tuple[int] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
 ) -> Tuple[List[dict], bool]:
+    """after_id / before_id: query the feeds after / before the id in the sort order without OFFSET.
+    has_more means more rows before the result while querying with before_id."""
     # task_ids arg type is tuple for cache hashing
     offset = page_size * (page - 1)
     query = feeds.select()
@@ -440,29 +668,36 @@ async def query_feeds(
             query = query.where(feeds.c.task_id == task_id)
         if task_name is not None:
             query = query.where(feeds.c.name == task_name)
+    cursor_id = after_id or before_id
+    reverse = not after_id and bool(before_id)
+    if cursor_id and order_by != 'id':
+        raise ValueError('cursor pagination requires order_by id')
     if order_by and sort:
         ob = getattr(feeds.c, order_by, None)
         if ob is None:
             raise ValueError(f'bad order_by {order_by}')
-        if sort.lower() == 'desc':
-            ob = sqlalchemy.desc(ob)
-        elif sort.lower() == 'asc':
-            ob = sqlalchemy.asc(ob)
-        else:
-            raise ValueError(
-                f"bad sort arg {sort} not in ('desc', 'asc', 'DESC', 'ASC')")
-        query = query.order_by(ob)
+        desc = get_sort_desc(sort) != reverse
+        if cursor_id:
+            offset = 0
+            query = query.where(get_keyset_clause([ob], (cursor_id,), desc))
+        order = sqlalchemy.desc if desc else sqlalchemy.asc
+        query = query.order_by(order(ob))
+    elif cursor_id:
+        raise ValueError('cursor pagination requires order_by and sort')
     query = query.limit(page_size + 1).offset(offset)
     _result = await Config.db.fetch_all(query=query)
     has_more = len(_result) > page_size
     result = [dict(i) for i in _result][:page_size]
-    query_string = str(query.compile(
-        compile_kwargs={"literal_binds": True})).replace('\n', '')
-    Config.logger.info(
-        f'[Query] {len(result)} feeds (has_more={has_more}): {query_string}')
+    if reverse:
+        result.reverse()
+    log_query(f'[Query] {len(result)} feeds (has_more={has_more})', query)
     return result, has_more
 
 
+# the caches invalidated by invalidate_task
+task_caches: List[DependentCache] = [query_tasks, query_task_ids, query_feeds]
+
+
 @alru_cache(maxsize=Config.query_groups_cache_maxsize)
 async def query_all_groups() -> List[dict]:
     query = groups.select()
@@ -470,9 +705,7 @@ async def query_all_groups() -> List[dict]:
     result = []
     for row in rows:
         result.append(dict(row))
-    query_string = str(query.compile(
-        compile_kwargs={"literal_binds": True})).replace('\n', '')
-    Config.logger.info(f'[Query] {len(result)} groups: {query_string}')
+    log_query(f'[Query] {len(result)} groups', query)
     return result
 
 
@@ -488,7 +721,39 @@ async def query_task_errors(tag: str = '',
     query = query.order_by(sqlalchemy.desc('last_change_time'))
     _result: list = await Config.db.fetch_all(query=query)
     result = [dict(task) for task in _result]
-    query_string = str(query.compile(
-        compile_kwargs={"literal_binds": True})).replace('\n', '')
-    Config.logger.info(f'[Query] {len(result)} task errors: {query_string}')
+    log_query(f'[Query] {len(result)} task errors', query)
     return result
+
+
+async def query_task_results(task_id: int,
+                             limit: Optional[int] = None) -> List[dict]:
+    """The history of task results, newer first, as the old result_list."""
+    query = results.select().where(results.c.task_id == task_id).order_by(
+        sqlalchemy.desc(results.c.time), sqlalchemy.desc(results.c.id))
+    if limit:
+        query = query.limit(limit)
+    rows = await Config.db.fetch_all(query=query)
+    return [{
+        'result': loads(row.result),
+        'time': row.time.strftime('%Y-%m-%d %H:%M:%S')
+    } for row in rows]
+
+
+async def insert_result_list(task_id: int, result_list: list,
+                             default_time: datetime) -> int:
+    """Insert the old style result_list (newer first) into the results table."""
+    values = []
+    for item in result_list[::-1]:
+        try:
+            time = datetime.strptime(item['time'], '%Y-%m-%d %H:%M:%S')
+        except (KeyError, TypeError, ValueError):
+            time = default_time
+        values.append({
+            'task_id': task_id,
+            'result': dumps(item.get('result', {})),
+            'time': time
+        })
+    if values:
+        query = 'INSERT INTO results (`task_id`, `result`, `time`) values (:task_id, :result, :time)'
+        await Config.db.execute_many(query=query, values=values)
+    return len(values)
@@ -0,0 +1,82 @@
+from asyncio import get_event_loop
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from uniparser import CrawlerRule, Uniparser
+
+from .config import Config
+from .utils import get_content_hash
+
+# returned by the worker which has not cached the rule, then retry with the rule JSON
+RULE_MISSING = '__rule_missing__'
+# max rules cached in each worker
+RULE_CACHE_SIZE = 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+# worker variables
+_uniparser: Optional[Uniparser] = None
+_rules: Dict[str, CrawlerRule] = {}
+
+
+class ParseResponse(object):
+    """Picklable copy of the response, as the context['resp'] in the workers."""
+
+    def __init__(self, resp):
+        self.url = str(getattr(resp, 'url', ''))
+        self.status_code = getattr(resp, 'status_code', None)
+        self.headers = dict(getattr(resp, 'headers', None) or {})
+        self.encoding = getattr(resp, 'encoding', None)
+
+
+def init_worker(allow_new_request=False):
+    global _uniparser
+    from .settings import setup_udf_globals
+    setup_udf_globals(allow_new_request)
+    _uniparser = Uniparser()
+
+
+def parse_in_worker(rule_key: str, rule_json: Optional[str], text,
+                    context: dict):
+    rule = _rules.get(rule_key)
+    if rule is None:
+        if rule_json is None:
+            return RULE_MISSING
+        if len(_rules) >= RULE_CACHE_SIZE:
+            _rules.clear()
+        rule = _rules[rule_key] = CrawlerRule.loads(rule_json)
+    # the cached rule is shared by the parses of this worker
+    rule_context = dict(rule.context)
+    rule_context.update(context)
+    return _uniparser.parse(text, rule, rule_context)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(Config.parse_workers,
+                                    initializer=init_worker,
+                                    initargs=(Config.allow_new_request,))
+    return _pool
+
+
+async def parse_in_pool(rule: CrawlerRule, text, resp, request_args: dict):
+    """Parse the text with the rule in the process pool, the rule JSON is only sent
+    to the worker which has not cached it."""
+    loop = get_event_loop()
+    pool = get_pool()
+    rule_json = rule.dumps()
+    rule_key = get_content_hash(rule_json)
+    context = {'resp': ParseResponse(resp), 'request_args': request_args}
+    result = await loop.run_in_executor(pool, parse_in_worker, rule_key, None,
+                                        text, context)
+    if result == RULE_MISSING:
+        result = await loop.run_in_executor(pool, parse_in_worker, rule_key,
+                                            rule_json, text, context)
+    return result
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
@@ -0,0 +1,106 @@
+import gzip
+from asyncio import get_event_loop, sleep
+from datetime import datetime, timedelta
+from json import dumps
+from typing import List
+
+import sqlalchemy
+
+from .config import Config, ensure_dir
+from .models import feeds, task_caches
+
+
+def write_archive(rows: List[dict]):
+    """Append the rows into CONFIG_DIR/archives/feeds-%Y%m%d.jsonl.gz, gzip members can be concatenated."""
+    archive_dir = ensure_dir(Config.CONFIG_DIR / 'archives')
+    path = archive_dir / f'feeds-{datetime.now().strftime("%Y%m%d")}.jsonl.gz'
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for row in rows:
+            f.write(dumps(row, ensure_ascii=False, default=str))
+            f.write('\n')
+
+
+async def delete_feeds_batches(where) -> int:
+    """Delete the feeds matched the where clause in small batches, archive them if Config.feeds_archive."""
+    db = Config.db
+    total = 0
+    batch_size = Config.feeds_retention_batch_size
+    if Config.feeds_archive:
+        query = feeds.select()
+    else:
+        query = feeds.select().with_only_columns(feeds.c.id)
+    query = query.where(where).order_by(feeds.c.id).limit(batch_size)
+    while not Config.is_shutdown:
+        rows = [dict(row) for row in await db.fetch_all(query=query)]
+        if not rows:
+            break
+        if Config.feeds_archive:
+            # 3.6 has no get_running_loop
+            await get_event_loop().run_in_executor(None, write_archive, rows)
+        ids = [row['id'] for row in rows]
+        await db.execute(feeds.delete().where(feeds.c.id.in_(ids)))
+        total += len(ids)
+        if len(rows) < batch_size:
+            break
+        # let the crawler write between the batches
+        await sleep(Config.feeds_retention_batch_interval)
+    return total
+
+
+async def prune_feeds_by_days(days: int) -> int:
+    cutoff = datetime.now() - timedelta(days=days)
+    return await delete_feeds_batches(feeds.c.ts_create < cutoff)
+
+
+async def prune_feeds_by_count(count: int) -> int:
+    """Keep the newest count feeds of each task."""
+    db = Config.db
+    total = 0
+    query = sqlalchemy.select(feeds.c.task_id).distinct()
+    task_ids = [row.task_id for row in await db.fetch_all(query=query)]
+    for task_id in task_ids:
+        # the oldest id to keep, with the index of (task_id, id)
+        query = feeds.select().with_only_columns(feeds.c.id).where(
+            feeds.c.task_id == task_id).order_by(
+                feeds.c.id.desc()).limit(1).offset(count - 1)
+        cutoff_id = await db.fetch_val(query=query)
+        if cutoff_id is None:
+            continue
+        total += await delete_feeds_batches(
+            sqlalchemy.and_(feeds.c.task_id == task_id,
+                            feeds.c.id < cutoff_id))
+    return total
+
+
+async def incremental_vacuum():
+    """Release the free pages of SQLite with auto_vacuum=INCREMENTAL."""
+    if not Config.db_url.startswith('sqlite'):
+        return
+    db = Config.db
+    auto_vacuum = await db.fetch_val('PRAGMA auto_vacuum')
+    if auto_vacuum != 2:
+        Config.logger.warning(
+            f'[Retention] SQLite auto_vacuum is {auto_vacuum}, not INCREMENTAL(2), run `PRAGMA auto_vacuum=INCREMENTAL; VACUUM;` once to release the free pages.'
+        )
+        return
+    # each step of the pragma frees one page, so fetch all of the raw cursor.
+    # in a transaction for the writer connection of SQLiteDatabase
+    async with db.transaction(), db.connection() as connection:
+        cursor = await connection.raw_connection.execute(
+            f'PRAGMA incremental_vacuum({int(Config.feeds_vacuum_pages)})')
+        await cursor.fetchall()
+        await cursor.close()
+
+
+async def prune_feeds() -> int:
+    total = 0
+    if Config.feeds_retention_days > 0:
+        total += await prune_feeds_by_days(Config.feeds_retention_days)
+    if Config.feeds_retention_count > 0:
+        total += await prune_feeds_by_count(Config.feeds_retention_count)
+    if total:
+        for cache in task_caches:
+            cache.cache_clear()
+        await incremental_vacuum()
+    Config.logger.info(f'[Retention] {total} feeds deleted.')
+    return total
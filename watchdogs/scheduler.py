@@ -0,0 +1,126 @@
+from asyncio import Event, TimeoutError, wait_for
+from datetime import datetime
+from heapq import heapify, heappop, heappush
+from typing import Dict, List, Optional, Tuple
+
+from .config import Config
+from .models import tasks
+
+
+class TaskScheduler:
+    """In-memory min-heap of the enabled tasks, keyed by next_check_time.
+
+    Loaded from db once, then kept up to date by the crawler and the task routes,
+    so the background loop can sleep exactly until the next due task instead of polling the db.
+    Outdated heap items are skipped lazily while popping."""
+
+    def __init__(self):
+        self.heap: List[Tuple[datetime, int]] = []
+        # task_id: next_check_time, the only valid items of the heap
+        self.entries: Dict[int, datetime] = {}
+        self._wakeup: Optional[Event] = None
+
+    @property
+    def wakeup(self) -> Event:
+        # lazy init for the running loop
+        if self._wakeup is None:
+            self._wakeup = Event()
+        return self._wakeup
+
+    async def load(self):
+        query = tasks.select().with_only_columns(
+            tasks.c.task_id,
+            tasks.c.next_check_time).where(tasks.c.enable == 1)
+        rows = await Config.db.fetch_all(query=query)
+        self.entries = {row.task_id: row.next_check_time for row in rows}
+        self.heap = [(value, key) for key, value in self.entries.items()]
+        heapify(self.heap)
+        self.wakeup.set()
+        Config.logger.info(f'[Scheduler] {len(self.entries)} tasks loaded.')
+
+    async def refresh(self, task_id: int):
+        """Reload the task from db, for the task routes which changed it."""
+        query = tasks.select().with_only_columns(
+            tasks.c.enable,
+            tasks.c.next_check_time).where(tasks.c.task_id == task_id)
+        row = await Config.db.fetch_one(query=query)
+        if row and row.enable:
+            self.push(task_id, row.next_check_time)
+        else:
+            self.remove(task_id)
+
+    async def refresh_many(self, task_ids: List[int], min_time: datetime):
+        """Reload the tasks from db, not earlier than min_time. For the tasks leased by the other workers."""
+        if not task_ids:
+            return
+        query = tasks.select().with_only_columns(
+            tasks.c.task_id, tasks.c.enable,
+            tasks.c.next_check_time).where(tasks.c.task_id.in_(task_ids))
+        rows = await Config.db.fetch_all(query=query)
+        for row in rows:
+            if row.enable:
+                self.push(row.task_id, max(row.next_check_time, min_time))
+
+    def push(self, task_id: int, next_check_time: datetime):
+        if self.entries.get(task_id) == next_check_time:
+            return
+        self.entries[task_id] = next_check_time
+        heappush(self.heap, (next_check_time, task_id))
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            # too many outdated items
+            self.heap = [(value, key) for key, value in self.entries.items()]
+            heapify(self.heap)
+        self.wakeup.set()
+
+    def requeue(self, task_ids: List[int], next_check_time: datetime):
+        """Push back the popped task_ids which the failed crawl did not push."""
+        for task_id in task_ids:
+            if task_id not in self.entries:
+                self.push(task_id, next_check_time)
+
+    def remove(self, task_id: int):
+        self.entries.pop(task_id, None)
+
+    def _clean_top(self):
+        while self.heap:
+            next_check_time, task_id = self.heap[0]
+            if self.entries.get(task_id) == next_check_time:
+                break
+            heappop(self.heap)
+
+    @property
+    def next_check_time(self) -> Optional[datetime]:
+        self._clean_top()
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    def pop_due(self,
+                now: Optional[datetime] = None,
+                limit: Optional[int] = None) -> List[int]:
+        """Pop the task_ids which next_check_time <= now, they will be pushed back after crawling."""
+        now = now or datetime.now()
+        result: List[int] = []
+        while limit is None or len(result) < limit:
+            self._clean_top()
+            if not self.heap or self.heap[0][0] > now:
+                break
+            _, task_id = heappop(self.heap)
+            self.entries.pop(task_id, None)
+            result.append(task_id)
+        return result
+
+    async def wait(self):
+        """Sleep until the next task is due, or the heap changed."""
+        self.wakeup.clear()
+        next_check_time = self.next_check_time
+        if next_check_time is None:
+            timeout = Config.check_interval
+        else:
+            timeout = (next_check_time - datetime.now()).total_seconds()
+            if timeout <= 0:
+                return
+        try:
+            await wait_for(self.wakeup.wait(), timeout=timeout)
+        except TimeoutError:
+            pass
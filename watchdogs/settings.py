@@ -4,6 +4,9 @@ from datetime import datetime
 from functools import lru_cache
 from json import dumps, loads
 from logging.handlers import RotatingFileHandler
+from os import getpid
+from socket import gethostname
+from uuid import uuid4
 
 from frequency_controller import AsyncFrequency
 from uniparser.parsers import Uniparser
@@ -66,13 +69,36 @@ def setup_logger():
     return watchdogs_logger
 
 
+def get_db_options(db_url: str) -> dict:
+    if db_url.startswith('sqlite'):
+        # sqlite3.connect args, no pool
+        options = {'cached_statements': Config.db_cached_statements}
+    else:
+        options = {
+            'min_size': Config.db_pool_min_size,
+            'max_size': Config.db_pool_max_size,
+        }
+        if db_url.startswith('postgres'):
+            options['statement_cache_size'] = Config.db_cached_statements
+    options.update(Config.db_options)
+    return options
+
+
 def setup_models():
     from databases import Database
 
     # lazy import models to config cache size, means set cache after run main.init_app
     from .models import Metas, RuleStorageDB, create_tables
 
-    Config.db = Database(Config.db_url)
+    options = get_db_options(Config.db_url)
+    if Config.sqlite_profile and Config.db_url.startswith('sqlite:///'):
+        from .sqlite import SQLiteDatabase
+        Config.db = SQLiteDatabase(Config.db_url,
+                                   min_size=Config.db_pool_min_size,
+                                   max_size=Config.db_pool_max_size,
+                                   **options)
+    else:
+        Config.db = Database(Config.db_url, **options)
     Config.rule_db = RuleStorageDB(Config.db)
     Config.metas = Metas(Config.db)
     # if Config.db_backup_function is None and Config.db_url.startswith(
@@ -81,7 +107,8 @@ def setup_models():
     create_tables(str(Config.db.url))
 
 
-async def setup_uniparser():
+def setup_udf_globals(allow_new_request=False):
+    """Modules and functions for UDFParser, also used by the parse workers."""
     import base64
     import binascii
     import datetime
@@ -89,7 +116,6 @@ async def setup_uniparser():
     import random
     import re
 
-    import uniparser.fastapi_ui
     from torequests.utils import (
         curlparse,
         escape,
@@ -115,9 +141,7 @@ async def setup_uniparser():
         urlsplit,
         urlunparse,
     )
-    from uniparser.config import GlobalConfig
     from uniparser.parsers import UDFParser
-    from uniparser.utils import TorequestsAiohttpAsyncAdapter
     UDFParser._GLOBALS_ARGS.update({
         're': re,
         'datetime': datetime,
@@ -149,6 +173,25 @@ async def setup_uniparser():
         'base64': base64,
         'binascii': binascii,
     })
+    if allow_new_request:
+        # will allow use requests / aiohttp / tPool / Requests in UDFParser
+        import aiohttp
+        import requests
+        from torequests.dummy import Requests
+        from torequests.main import tPool
+
+        UDFParser._GLOBALS_ARGS.update(aiohttp=aiohttp,
+                                       requests=requests,
+                                       Requests=Requests,
+                                       tPool=tPool)
+
+
+async def setup_uniparser():
+    import uniparser.fastapi_ui
+    from uniparser.config import GlobalConfig
+    from uniparser.utils import TorequestsAiohttpAsyncAdapter
+
+    setup_udf_globals(Config.allow_new_request)
     GlobalConfig.GLOBAL_TIMEOUT = Config.downloader_timeout
     Uniparser._DEFAULT_ASYNC_FREQUENCY = AsyncFrequency(
         *Config.DEFAULT_HOST_FREQUENCY)
@@ -223,6 +266,7 @@ async def setup_crawler():
 
     from .callbacks import CallbackHandler
 
+    await Config.rule_db.prewarm()
     crawler = Crawler(uniparser=Config.uniparser, storage=Config.rule_db)
     Config.crawler = crawler
     if Config.callback_handler is None:
@@ -248,11 +292,20 @@ async def refresh_token():
 
 
 async def setup_background():
-    from .background import background_loop, db_backup_handler
-    from .crawler import crawl_once
-    Config.background_funcs.append(crawl_once)
+    from .background import (background_loop, db_backup_handler,
+                             feeds_retention_handler, scheduler_loop)
+    from .crawler import crawl_once, ramp_due_tasks
+    await ramp_due_tasks()
+    if Config.scheduler_mode == 'heap':
+        from .scheduler import TaskScheduler
+        Config.scheduler = TaskScheduler()
+        Config.scheduler_task = ensure_future(scheduler_loop(crawl_once))
+    else:
+        Config.background_funcs.append(crawl_once)
     if Config.db_backup_function:
         Config.background_funcs.append(db_backup_handler)
+    if Config.feeds_retention_days > 0 or Config.feeds_retention_count > 0:
+        Config.background_funcs.append(feeds_retention_handler)
     Config.background_task = ensure_future(
         background_loop(Config.background_funcs))
 
@@ -277,6 +330,8 @@ async def setup_app(app):
     db = Config.db
     if not db:
         raise RuntimeError('No database?')
+    if not Config.worker_id:
+        Config.worker_id = f'{gethostname()}-{getpid()}-{uuid4().hex[:8]}'[-64:]
     await db.connect()
     await setup_md5_salt()
     # refresh_token should be after setup_md5_salt
@@ -298,31 +353,44 @@ async def release_app(app):
     Config.is_shutdown = True
     if Config.background_task and not Config.background_task.done():
         Config.background_task.cancel()
+    if Config.scheduler_task and not Config.scheduler_task.done():
+        Config.scheduler_task.cancel()
+    from .crawler import engine
+    await engine.close()
+    from .pool import shutdown_pool
+    shutdown_pool()
     if Config.db:
         await Config.db.disconnect()
 
 
 async def default_db_backup_sqlite():
+    from pathlib import Path
+
+    from .sqlite import backup_sqlite, gzip_file
     current_time = datetime.now().strftime('%Y%m%d%H%M%S')
-    for storage_path in Config.CONFIG_DIR.iterdir():
-        if storage_path.name == 'storage.sqlite':
-            import shutil
-            from pathlib import Path
-            backup_dir: Path = ensure_dir(Config.CONFIG_DIR / 'backups')
-            backup_path = backup_dir / f'storage-{current_time}.sqlite'
-            # 3.6 has no get_running_loop
-            loop = get_event_loop()
-            # wait for copy
-            future = loop.run_in_executor(None, shutil.copy, str(storage_path),
-                                          str(backup_path))
-            await future
-            # remove overdue files
-            backup_file_paths = sorted([i for i in backup_dir.iterdir()],
-                                       key=lambda path: path.name,
-                                       reverse=True)
-            path_to_del = backup_file_paths[Config.db_backup_count:]
-            for p in path_to_del:
-                p.unlink()
+    storage_path = Path(Config.db.url.database)
+    if not storage_path.is_file():
+        return
+    backup_dir: Path = ensure_dir(Config.CONFIG_DIR / 'backups')
+    backup_path = backup_dir / f'storage-{current_time}.sqlite'
+    # 3.6 has no get_running_loop
+    loop = get_event_loop()
+    # the online backup in a thread, consistent while the app writing
+    await loop.run_in_executor(None, backup_sqlite, str(storage_path),
+                               str(backup_path), Config.db_backup_pages,
+                               Config.db_backup_interval)
+    if Config.db_backup_gzip:
+        backup_path = await loop.run_in_executor(None, gzip_file, backup_path)
+    Config.logger.info(
+        f'[Backup] {backup_path} ({backup_path.stat().st_size} bytes)')
+    # remove overdue files
+    backup_file_paths = sorted([i for i in backup_dir.iterdir()],
+                               key=lambda path: path.name,
+                               reverse=True)
+    path_to_del = backup_file_paths[Config.db_backup_count:]
+    for p in path_to_del:
+        p.unlink()
+    return str(backup_path)
 
 
 def get_host_freq_list(host):
@@ -0,0 +1,228 @@
+import gzip
+import shutil
+import sqlite3
+import time
+from asyncio import Lock, Task
+from pathlib import Path
+from typing import List, Optional
+
+import aiosqlite
+from databases import Database
+from databases.backends.sqlite import SQLitePool
+from databases.core import Connection
+
+from .config import Config
+
+try:
+    from asyncio import current_task
+except ImportError:
+    # python3.6
+    current_task = Task.current_task
+
+
+class ProfileConnection(sqlite3.Connection):
+    """sqlite3 connection factory which applies Config.sqlite_pragmas on connect."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for key, value in Config.sqlite_pragmas.items():
+            self.execute(f'PRAGMA {key}={value}').fetchall()
+
+
+class ReaderPool(SQLitePool):
+    """Keep the released connections for reuse, instead of opening a new
+    connection (and thread) for each task."""
+
+    def __init__(self, url, max_size: int = 10, **options):
+        super().__init__(url, **options)
+        self.max_size = max_size
+        self.idle: List[aiosqlite.Connection] = []
+
+    async def acquire(self) -> aiosqlite.Connection:
+        if self.idle:
+            return self.idle.pop()
+        return await super().acquire()
+
+    async def release(self, connection: aiosqlite.Connection):
+        if len(self.idle) < self.max_size:
+            self.idle.append(connection)
+        else:
+            await super().release(connection)
+
+    async def prewarm(self, min_size: int):
+        for _ in range(min_size - len(self.idle)):
+            self.idle.append(await super().acquire())
+
+    async def close(self):
+        while self.idle:
+            await super().release(self.idle.pop())
+
+
+class WriterContext:
+    """Hold the writer connection of the SQLiteDatabase, reentrant in the same task."""
+    __slots__ = ('db', 'owner')
+
+    def __init__(self, db: 'SQLiteDatabase'):
+        self.db = db
+        self.owner = False
+
+    async def __aenter__(self) -> Connection:
+        db = self.db
+        task = current_task()
+        if task is None or db._writer_task is not task:
+            await db._write_lock.acquire()
+            db._writer_task = task
+            self.owner = True
+        return db._writer
+
+    async def __aexit__(self, *exc_info):
+        if self.owner:
+            self.owner = False
+            self.db._writer_task = None
+            self.db._write_lock.release()
+
+
+class WriterTransaction:
+    """Run the transaction in the writer connection, with the writer lock held."""
+    __slots__ = ('writer', 'transaction')
+
+    def __init__(self, writer: WriterContext, transaction):
+        self.writer = writer
+        self.transaction = transaction
+
+    async def __aenter__(self):
+        await self.writer.__aenter__()
+        try:
+            return await self.transaction.__aenter__()
+        except BaseException:
+            await self.writer.__aexit__(None, None, None)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self.transaction.__aexit__(*exc_info)
+        finally:
+            await self.writer.__aexit__(*exc_info)
+
+
+class SQLiteDatabase(Database):
+    """SQLite database in WAL mode, the writes are serialized by one writer connection.
+
+    execute / execute_many / transaction run in the writer connection with a lock, the
+    reads inside them use the writer too, so the transaction could read its own writes.
+    Other reads run in the task-local connections reused from ReaderPool, and WAL
+    will not block them by the writer."""
+
+    def __init__(self,
+                 url: str,
+                 min_size: int = 1,
+                 max_size: int = 10,
+                 **options):
+        options.setdefault('factory', ProfileConnection)
+        super().__init__(url, **options)
+        self.min_size = min_size
+        # replace the pool of the backend, which opens a connection for each acquire
+        self._backend._pool = ReaderPool(self.url, max_size=max_size, **options)
+        self._writer: Optional[Connection] = None
+        self._write_lock: Optional[Lock] = None
+        # the task holding the writer, instead of the contextvars of python3.7+
+        self._writer_task: Optional[Task] = None
+
+    async def connect(self):
+        if self.is_connected:
+            return
+        await super().connect()
+        await self._backend._pool.prewarm(self.min_size)
+        self._write_lock = Lock()
+        self._writer = Connection(self._backend)
+        # keep the writer connection open until disconnect
+        await self._writer.__aenter__()
+
+    async def disconnect(self):
+        if self._writer is not None:
+            await self._writer.__aexit__()
+            self._writer = None
+        await super().disconnect()
+        await self._backend._pool.close()
+
+    def write(self) -> WriterContext:
+        """Hold the writer connection, reentrant in the same task."""
+        return WriterContext(self)
+
+    def connection(self) -> Connection:
+        if (self._writer is not None and self._writer_task is not None and
+                self._writer_task is current_task()):
+            return self._writer
+        return super().connection()
+
+    async def execute(self, query, values: dict = None):
+        async with self.write():
+            return await super().execute(query, values)
+
+    async def execute_many(self, query, values: list):
+        async with self.write():
+            return await super().execute_many(query, values)
+
+    def transaction(self, **kwargs) -> WriterTransaction:
+        return WriterTransaction(self.write(), super().transaction(**kwargs))
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def backup_sqlite(source: str,
+                  target: str,
+                  pages: int = 1024,
+                  interval: float = 0.01,
+                  max_restarts: int = 3):
+    """Online backup with the SQLite backup API, copy pages per step and sleep
+    interval between the steps to throttle the disk I/O.
+
+    The backup restarts if the source is written by the other connections, so
+    fall back to `VACUUM INTO` (one read transaction) after max_restarts."""
+    logger = Config.logger
+    state = {'remaining': None, 'restarts': 0, 'percent': -1}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise BackupRestarted()
+        state['remaining'] = remaining
+        percent = (total - remaining) * 100 // (total or 1)
+        if percent // 10 > state['percent'] // 10:
+            state['percent'] = percent
+            logger.info(
+                f'[Backup] {percent}% ({total - remaining}/{total} pages) {target}'
+            )
+        time.sleep(interval)
+
+    source_conn = sqlite3.connect(source)
+    try:
+        if not hasattr(source_conn, 'backup'):
+            # python3.6 has no backup API
+            source_conn.execute('VACUUM INTO ?', (target,))
+            return
+        target_conn = sqlite3.connect(target)
+        try:
+            source_conn.backup(target_conn, pages=pages, progress=progress)
+            return
+        except BackupRestarted:
+            logger.warning(
+                f'[Backup] restarted {state["restarts"]} times by the writes, use VACUUM INTO.'
+            )
+        finally:
+            target_conn.close()
+        Path(target).unlink()
+        source_conn.execute('VACUUM INTO ?', (target,))
+    finally:
+        source_conn.close()
+
+
+def gzip_file(path: Path) -> Path:
+    gzip_path = path.with_name(f'{path.name}.gz')
+    with open(path, 'rb') as f_in, gzip.open(gzip_path, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    path.unlink()
+    return gzip_path
@@ -10,6 +10,7 @@ var Main = {
             has_more: true,
             task_list: [],
             current_page: 0,
+            next_cursor: "",
             host_list: [],
             visible_host_list: [],
             current_host: "",
@@ -297,6 +298,7 @@ var Main = {
         reload_tasks() {
             this.task_list = []
             this.current_page = 0
+            this.next_cursor = ""
             this.load_tasks()
         },
         load_tasks() {
@@ -308,6 +310,7 @@ var Main = {
             }
             current_page = this.current_page + 1
             this.query_tasks_args["page"] = current_page
+            this.query_tasks_args["after"] = this.next_cursor
             this.$http
                 .get("load_tasks", {
                     params: this.query_tasks_args,
@@ -321,6 +324,7 @@ var Main = {
                             })
                             this.has_more = result.has_more
                             this.current_page = current_page
+                            this.next_cursor = result.next_cursor || ""
                         } else {
                             this.$message.error({
                                 message: "Loading tasks failed: " + result.msg,
@@ -440,32 +444,40 @@ var Main = {
             }
         },
         show_result_list(row) {
-            var text = "<table>"
-            var items = JSON.parse(row.result_list || "[]")
-            items.forEach((item) => {
-                result = item.result
-                if (result.url) {
-                    var href = 'href="' + (result.url || "") + '"'
-                } else {
-                    var href = ""
+            this.$http.post("lite", { task_id: row.task_id }).then(
+                (r) => {
+                    var text = "<table>"
+                    r.body.result_list.forEach((item) => {
+                        result = item.result
+                        if (result.url) {
+                            var href = 'href="' + (result.url || "") + '"'
+                        } else {
+                            var href = ""
+                        }
+                        text +=
+                            '<tr><td class="time-td">' +
+                            item.time +
+                            '</td><td><a target="_blank" ' +
+                            href +
+                            ">" +
+                            this.escape_html(result.title || result.text) +
+                            "</a></td></tr>"
+                    })
+                    text += "</table>"
+                    this.$alert(text, "Task result list: " + row.name, {
+                        confirmButtonText: "OK",
+                        center: true,
+                        dangerouslyUseHTMLString: true,
+                        closeOnClickModal: true,
+                        closeOnPressEscape: true,
+                    })
+                },
+                (r) => {
+                    this.$message.error({
+                        message: "connect failed: " + r.status,
+                    })
                 }
-                text +=
-                    '<tr><td class="time-td">' +
-                    item.time +
-                    '</td><td><a target="_blank" ' +
-                    href +
-                    ">" +
-                    this.escape_html(result.title || result.text) +
-                    "</a></td></tr>"
-            })
-            text += "</table>"
-            this.$alert(text, "Task result list: " + row.name, {
-                confirmButtonText: "OK",
-                center: true,
-                dangerouslyUseHTMLString: true,
-                closeOnClickModal: true,
-                closeOnPressEscape: true,
-            })
+            )
         },
         force_crawl(index, row) {
             this.$http
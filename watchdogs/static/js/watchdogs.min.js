@@ -1 +1 @@
-var Main={data:()=>({activeName:"tasks",uniparser_iframe_loaded:!1,task_info_visible:!1,rule_info_visible:!1,current_host_rule:{},new_task_form:{},has_more:!0,task_list:[],current_page:0,host_list:[],visible_host_list:[],current_host:"",tag_types:["","success","info","warning","danger"],query_tasks_args:{order_by:"last_change_time",sort:"desc",tag:""},callback_workers:{},custom_links:[],custom_tabs:[],current_cb_doc:"",init_iframe_rule_json:"",clicked_tab_names:{}}),methods:{add_new_task(){try{JSON.parse(this.new_task_form.result_list)}catch(e){this.$alert("Invalid JSON for result_list.");return}try{JSON.parse(this.new_task_form.request_args)}catch(s){this.$alert("Invalid JSON for request_args.");return}this.task_info_visible=!1;let t=JSON.stringify(this.new_task_form);this.$http.post("add_new_task",t).then(e=>{var s=e.body;"ok"==s.msg?(this.$message({message:"Update task "+this.new_task_form.name+" success: "+s.msg,type:"success"}),this.reload_tasks()):this.$message.error({message:"Update task "+this.new_task_form.name+" failed: "+s.msg,duration:0,showClose:!0})},e=>{this.$message.error({message:"connect failed: "+e.status,duration:0,showClose:!0})})},init_iframe_crawler_rule(e){e?this.sub_app.new_rule_json=e:/httpbin\.org\/html/g.test(this.sub_app.new_rule_json)?this.sub_app.new_rule_json='{"name":"","request_args":{"method":"get","url":"https://importpython.com/blog/feed/","headers":{"User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36"}},"parse_rules":[{"name":"text","chain_rules":[["xml","channel>item>title","$text"],["python","getitem","[0]"]],"child_rules":""},{"name":"url","chain_rules":[["xml","channel>item>link","$text"],["python","getitem","[0]"]],"child_rules":""}],"regex":"^https?://importpython.com/blog/feed/$","encoding":""}':this.sub_app.new_rule_json='{"name":"","request_args":{"method":"get","url":"http://httpbin.org/html","headers":{"User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36"}},"parse_rules":[{"name":"text","chain_rules":[["css","body h1","$text"],["python","getitem","[0]"]],"child_rules":""}],"regex":"^http://httpbin.org/html$","encoding":""}',this.sub_app.input_object="",this.sub_app.request_status="",this.sub_app.load_rule()},load_rule(e){this.sub_app.new_rule_json=e,this.sub_app.load_rule()},view_host_by_req(e){let s=JSON.parse(e).url;if(!s){this.$alert("request_args.url should not be null");return}document.getElementById("tab-rules").click(),setTimeout(()=>{this.current_host=new URL(s).hostname},0),this.task_info_visible=!1},view_crawler_rule_by_req(e){if(!e){this.$alert("request_args should not be null");return}this.$http.post("find_crawler_rule",e).then(e=>{var s=e.body;if("ok"==s.msg){let t=JSON.parse(s.result);this.view_crawler_rule(t),this.task_info_visible=!1}else this.$message.error({message:"rule not find in db: "+s.msg,duration:0,showClose:!0})},e=>{this.$message.error({message:"connect failed: "+e.status,duration:0,showClose:!0})})},view_crawler_rule(e){this.rule_info_visible=!1,document.getElementById("tab-new").click(),this.uniparser_iframe_loaded?this.init_iframe_crawler_rule(JSON.stringify(e)):this.init_iframe_rule_json=JSON.stringify(e)},edit_crawler_rule(e){this.$prompt("","Edit Crawler JSON",{confirmButtonText:"OK",cancelButtonText:"Cancel",center:!0,inputType:"textarea",closeOnClickModal:!1,inputValue:JSON.stringify(e,null,2)}).then(({value:e})=>{this.process_crawler_rule("add",JSON.parse(e),0)}).catch(e=>{this.$message({type:"error",message:e})})},process_crawler_rule(e,s,t){let r=JSON.stringify(s||JSON.parse(this.sub_app.current_crawler_rule_json)),a="crawler_rule."+e;1==t&&(a+="?force=1"),this.$http.post(a,r).then(t=>{var r=t.body;"ok"==r.msg?(this.$message({message:e+" rule success",type:"success"}),"pop"==e&&r.result&&this.show_host_rule(this.current_host_rule.host)):"add"==e&&/matched more than 1 rule/g.test(r.msg)?this.$confirm("Failed for url matched more than 1 rule, overwrite it?","Confirm",{confirmButtonText:"Yes",cancelButtonText:"No",type:"error"}).then(()=>{this.process_crawler_rule(e,s,1)}).catch(()=>{this.$message({type:"info",message:"Adding rule canceled."})}):this.$message.error({message:e+" rule failed: "+r.msg,duration:0,showClose:!0})},e=>{this.$message.error({message:"connect failed: "+e.status,duration:0,showClose:!0})})},show_form_add_new_task(e){if(e){let s="";try{s=this.sub_app.crawler_rule.name}catch(t){console.log(t)}this.new_task_form={task_id:null,name:s,enable:1,tag:"default",error:"",request_args:"",origin_url:"",interval:300,work_hours:"0, 24",max_result_count:30,result_list:"[]",custom_info:""};let r=JSON.parse(this.sub_app.current_crawler_rule_json);this.new_task_form.request_args=JSON.stringify(r.request_args),this.new_task_form.origin_url=r.request_args.url||""}this.task_info_visible=!0},change_enable(e){this.$http.get("enable_task",{params:{task_id:e.task_id,enable:e.enable}}).then(e=>{var s=e.body;"ok"!=s.msg&&this.$message.error({message:"Update enable failed: "+s.msg})},e=>{this.$message.error({message:"connect failed: "+e.status})})},sort_change(e){this.query_tasks_args={order_by:e.column.label,sort:(e.column.order||"").replace("ending","")},this.reload_tasks()},reload_tasks(){this.task_list=[],this.current_page=0,this.load_tasks()},load_tasks(){let e=new URLSearchParams(window.location.search).get("tag");e?this.query_tasks_args.tag=e:this.query_tasks_args.tag="",current_page=this.current_page+1,this.query_tasks_args.page=current_page,this.$http.get("load_tasks",{params:this.query_tasks_args}).then(e=>{var s=e.body;"ok"==s.msg?(s.tasks.forEach(e=>{this.task_list.push(e)}),this.has_more=s.has_more,this.current_page=current_page):(this.$message.error({message:"Loading tasks failed: "+s.msg}),this.has_more=s.has_more)},e=>{this.$message.error({message:"connect failed: "+e.status})})},load_hosts(){this.$http.get("load_hosts",{params:{host:this.current_host}}).then(e=>{var s=e.body;this.current_host=s.host||"",this.host_list=s.hosts,this.visible_host_list=this.host_list},e=>{this.$message.error({message:"connect failed: "+e.status})})},init_iframe(){this.sub_app&&(this.init_iframe_crawler_rule(this.init_iframe_rule_json),this.init_iframe_rule_json&&(this.$message.success({message:"Rule loaded."}),this.init_iframe_rule_json=""),this.uniparser_iframe_loaded=!0)},handleClick(e){e.name in this.clicked_tab_names||(this.clicked_tab_names[e.name]=1,"rules"==e.name&&this.load_hosts())},escape_html:e=>e?e.replace(/[&<>'"]/g,e=>({"&":"&amp;","<":"&lt;",">":"&gt;","'":"&#39;",'"':"&quot;"})[e]||e):"",show_time(e){var s='<table style="text-align: left;margin: 0 0 0 20%;font-weight: bold;">';JSON.parse(e.result_list||"[]"),s+='<tr><td>last_check_time</td><td class="time-td">'+e.last_check_time.replace(/\..*/,"").replace("T"," ")+"</td></tr>",s+='<tr><td>next_check_time</td><td class="time-td">'+e.next_check_time.replace(/\..*/,"").replace("T"," ")+"</td></tr>",s+='<tr><td>last_change_time</td><td class="time-td">'+e.last_change_time.replace(/\..*/,"").replace("T"," ")+"</td></tr>",s+="</table>",this.$alert(s,"Task result list: "+e.name,{confirmButtonText:"OK",center:!0,dangerouslyUseHTMLString:!0,closeOnClickModal:!0,closeOnPressEscape:!0})},get_latest_result(e,s=80){try{let t=JSON.parse(e);return t.title||t.text.slice(0,s)}catch(r){return e}},show_result_list(e){var s="<table>";JSON.parse(e.result_list||"[]").forEach(e=>{if((result=e.result).url)var t='href="'+(result.url||"")+'"';else var t="";s+='<tr><td class="time-td">'+e.time+'</td><td><a target="_blank" '+t+">"+this.escape_html(result.title||result.text)+"</a></td></tr>"}),s+="</table>",this.$alert(s,"Task result list: "+e.name,{confirmButtonText:"OK",center:!0,dangerouslyUseHTMLString:!0,closeOnClickModal:!0,closeOnPressEscape:!0})},force_crawl(e,s){this.$http.get("force_crawl",{params:{task_name:s.name}}).then(t=>{var r=t.body;if("ok"==r.msg){let a=r.task;Vue.set(this.task_list,e,a),a.error?this.$message.error({message:"Crawl task "+s.name+" "+a.error}):this.$message.success({message:"Crawl task "+s.name+" success"})}else this.$message.error({message:"Crawl task "+s.name+" failed: "+r.msg})},e=>{this.$message.error({message:"force_crawl connect failed: "+e.status})})},row_db_click(e){this.update_task(e)},show_task_error(e){app.$alert(e.error,"Crawler Error",{closeOnClickModal:!0,closeOnPressEscape:!0,center:!0})},update_task(e){this.new_task_form={task_id:e.task_id,name:e.name,enable:e.enable,tag:e.tag,request_args:e.request_args,origin_url:e.origin_url,interval:e.interval,work_hours:e.work_hours,max_result_count:e.max_result_count,result_list:e.result_list||"[]",custom_info:e.custom_info},this.show_form_add_new_task(!1)},delete_task(e,s){this.$confirm("Are you sure?","Confirm",{confirmButtonText:"Delete",cancelButtonText:"Cancel",type:"warning"}).then(()=>{this.$http.get("delete_task",{params:{task_id:s.task_id}}).then(t=>{var r=t.body;"ok"==r.msg?(this.$message.success({message:"Delete task "+s.name+" success"}),this.task_list.splice(e,1)):this.$message.error({message:"Delete task "+s.name+" failed: "+r.msg})},e=>{this.$message.error({message:"connect failed: "+e.status})})}).catch(()=>{this.$message({type:"info",message:"Canceled"})})},delete_host_rule(e){this.$confirm("Are you sure?","Confirm",{confirmButtonText:"Delete",cancelButtonText:"Cancel",type:"warning"}).then(()=>{this.$http.get("delete_host_rule",{params:{host:e}}).then(s=>{var t=s.body;"ok"==t.msg?(this.$message.success({message:"Delete host "+e+" rule success"}),this.current_host_rule={},this.rule_info_visible=!1,this.load_hosts()):this.$message.error({message:"Delete host "+e+" rule failed: "+JSON.stringify(t)})},e=>{this.$message.error({message:"connect failed: "+e.status})})}).catch(()=>{this.$message({type:"info",message:"Canceled"})})},show_host_rule(e){this.$http.get("get_host_rule",{params:{host:e}}).then(s=>{var t=s.body;"ok"==t.msg?(this.current_host_rule=t.host_rule,this.rule_info_visible=!0):this.$message.error({message:"get_host_rule "+e+" failed: "+JSON.stringify(t)})},e=>{this.$message.error({message:"connect failed: "+e.status})})},show_work_hours_doc(){let e=`<textarea style="height: ${3*window.innerHeight/4}px;width: 100%;">${this.work_hours_doc}</textarea  >`;this.$alert(e,"work_hours format doc",{dangerouslyUseHTMLString:!0,closeOnClickModal:!0,closeOnPressEscape:!0,customClass:"work_hours_doc"})},check_error_task({row:e,rowIndex:s}){if(e.error)return"warning-row"},click_cb_name(e){this.current_cb_doc=this.callback_workers[e],this.new_task_form.custom_info=e+":"},update_frequency(){let e=this.current_host_rule.host,s=this.current_host_rule.n||0,t=this.current_host_rule.interval||0;this.$http.get("update_host_freq",{params:{host:e,n:s,interval:t}}).then(r=>{var a=r.body;"ok"==a.msg?(this.$message({message:"Update frequency "+e+": "+a.msg,type:"success"}),this.current_host_rule.n=s,this.current_host_rule.interval=t):this.$message.error({message:"update_frequency "+e+" failed: "+JSON.stringify(a)})},e=>{this.$message.error({message:"connect failed: "+e.status})})}},watch:{current_host:function(e){this.visible_host_list=[],/^https?:\/\//g.test(e)&&(e=new URL(e).hostname,this.current_host=e),this.host_list.forEach(s=>{s.name.includes(e)&&this.visible_host_list.push(s)})},task_info_visible:function(e){e||(this.current_cb_doc="")}},computed:{uni_iframe:()=>document.getElementById("uni_iframe"),sub_app(){let e=this.uni_iframe;if(e)return e.contentWindow.app}}},vue_app=Vue.extend(Main),app=new vue_app({delimiters:["${","}"]}).$mount("#app");(()=>{var e;let s=document.getElementById("init_vars"),t=JSON.parse(window.atob(s.innerHTML));Object.keys(t).forEach(e=>{app[e]=t[e]}),s.parentNode.removeChild(s),new IntersectionObserver(e=>{!(e[0].intersectionRatio<=0)&&app.has_more&&app.load_tasks()}).observe(document.getElementById("auto_load"))})();
+var Main={data:()=>({activeName:"tasks",uniparser_iframe_loaded:!1,task_info_visible:!1,rule_info_visible:!1,current_host_rule:{},new_task_form:{},has_more:!0,task_list:[],current_page:0,next_cursor:"",host_list:[],visible_host_list:[],current_host:"",tag_types:["","success","info","warning","danger"],query_tasks_args:{order_by:"last_change_time",sort:"desc",tag:""},callback_workers:{},custom_links:[],custom_tabs:[],current_cb_doc:"",init_iframe_rule_json:"",clicked_tab_names:{}}),methods:{add_new_task(){try{JSON.parse(this.new_task_form.result_list)}catch(e){this.$alert("Invalid JSON for result_list.");return}try{JSON.parse(this.new_task_form.request_args)}catch(s){this.$alert("Invalid JSON for request_args.");return}this.task_info_visible=!1;let t=JSON.stringify(this.new_task_form);this.$http.post("add_new_task",t).then(e=>{var s=e.body;"ok"==s.msg?(this.$message({message:"Update task "+this.new_task_form.name+" success: "+s.msg,type:"success"}),this.reload_tasks()):this.$message.error({message:"Update task "+this.new_task_form.name+" failed: "+s.msg,duration:0,showClose:!0})},e=>{this.$message.error({message:"connect failed: "+e.status,duration:0,showClose:!0})})},init_iframe_crawler_rule(e){e?this.sub_app.new_rule_json=e:/httpbin\.org\/html/g.test(this.sub_app.new_rule_json)?this.sub_app.new_rule_json='{"name":"","request_args":{"method":"get","url":"https://importpython.com/blog/feed/","headers":{"User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36"}},"parse_rules":[{"name":"text","chain_rules":[["xml","channel>item>title","$text"],["python","getitem","[0]"]],"child_rules":""},{"name":"url","chain_rules":[["xml","channel>item>link","$text"],["python","getitem","[0]"]],"child_rules":""}],"regex":"^https?://importpython.com/blog/feed/$","encoding":""}':this.sub_app.new_rule_json='{"name":"","request_args":{"method":"get","url":"http://httpbin.org/html","headers":{"User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36"}},"parse_rules":[{"name":"text","chain_rules":[["css","body h1","$text"],["python","getitem","[0]"]],"child_rules":""}],"regex":"^http://httpbin.org/html$","encoding":""}',this.sub_app.input_object="",this.sub_app.request_status="",this.sub_app.load_rule()},load_rule(e){this.sub_app.new_rule_json=e,this.sub_app.load_rule()},view_host_by_req(e){let s=JSON.parse(e).url;if(!s){this.$alert("request_args.url should not be null");return}document.getElementById("tab-rules").click(),setTimeout(()=>{this.current_host=new URL(s).hostname},0),this.task_info_visible=!1},view_crawler_rule_by_req(e){if(!e){this.$alert("request_args should not be null");return}this.$http.post("find_crawler_rule",e).then(e=>{var s=e.body;if("ok"==s.msg){let t=JSON.parse(s.result);this.view_crawler_rule(t),this.task_info_visible=!1}else this.$message.error({message:"rule not find in db: "+s.msg,duration:0,showClose:!0})},e=>{this.$message.error({message:"connect failed: "+e.status,duration:0,showClose:!0})})},view_crawler_rule(e){this.rule_info_visible=!1,document.getElementById("tab-new").click(),this.uniparser_iframe_loaded?this.init_iframe_crawler_rule(JSON.stringify(e)):this.init_iframe_rule_json=JSON.stringify(e)},edit_crawler_rule(e){this.$prompt("","Edit Crawler JSON",{confirmButtonText:"OK",cancelButtonText:"Cancel",center:!0,inputType:"textarea",closeOnClickModal:!1,inputValue:JSON.stringify(e,null,2)}).then(({value:e})=>{this.process_crawler_rule("add",JSON.parse(e),0)}).catch(e=>{this.$message({type:"error",message:e})})},process_crawler_rule(e,s,t){let r=JSON.stringify(s||JSON.parse(this.sub_app.current_crawler_rule_json)),a="crawler_rule."+e;1==t&&(a+="?force=1"),this.$http.post(a,r).then(t=>{var r=t.body;"ok"==r.msg?(this.$message({message:e+" rule success",type:"success"}),"pop"==e&&r.result&&this.show_host_rule(this.current_host_rule.host)):"add"==e&&/matched more than 1 rule/g.test(r.msg)?this.$confirm("Failed for url matched more than 1 rule, overwrite it?","Confirm",{confirmButtonText:"Yes",cancelButtonText:"No",type:"error"}).then(()=>{this.process_crawler_rule(e,s,1)}).catch(()=>{this.$message({type:"info",message:"Adding rule canceled."})}):this.$message.error({message:e+" rule failed: "+r.msg,duration:0,showClose:!0})},e=>{this.$message.error({message:"connect failed: "+e.status,duration:0,showClose:!0})})},show_form_add_new_task(e){if(e){let s="";try{s=this.sub_app.crawler_rule.name}catch(t){console.log(t)}this.new_task_form={task_id:null,name:s,enable:1,tag:"default",error:"",request_args:"",origin_url:"",interval:300,work_hours:"0, 24",max_result_count:30,result_list:"[]",custom_info:""};let r=JSON.parse(this.sub_app.current_crawler_rule_json);this.new_task_form.request_args=JSON.stringify(r.request_args),this.new_task_form.origin_url=r.request_args.url||""}this.task_info_visible=!0},change_enable(e){this.$http.get("enable_task",{params:{task_id:e.task_id,enable:e.enable}}).then(e=>{var s=e.body;"ok"!=s.msg&&this.$message.error({message:"Update enable failed: "+s.msg})},e=>{this.$message.error({message:"connect failed: "+e.status})})},sort_change(e){this.query_tasks_args={order_by:e.column.label,sort:(e.column.order||"").replace("ending","")},this.reload_tasks()},reload_tasks(){this.task_list=[],this.current_page=0,this.next_cursor="",this.load_tasks()},load_tasks(){let e=new URLSearchParams(window.location.search).get("tag");e?this.query_tasks_args.tag=e:this.query_tasks_args.tag="",current_page=this.current_page+1,this.query_tasks_args.page=current_page,this.query_tasks_args.after=this.next_cursor,this.$http.get("load_tasks",{params:this.query_tasks_args}).then(e=>{var s=e.body;"ok"==s.msg?(s.tasks.forEach(e=>{this.task_list.push(e)}),this.has_more=s.has_more,this.current_page=current_page,this.next_cursor=s.next_cursor||""):(this.$message.error({message:"Loading tasks failed: "+s.msg}),this.has_more=s.has_more)},e=>{this.$message.error({message:"connect failed: "+e.status})})},load_hosts(){this.$http.get("load_hosts",{params:{host:this.current_host}}).then(e=>{var s=e.body;this.current_host=s.host||"",this.host_list=s.hosts,this.visible_host_list=this.host_list},e=>{this.$message.error({message:"connect failed: "+e.status})})},init_iframe(){this.sub_app&&(this.init_iframe_crawler_rule(this.init_iframe_rule_json),this.init_iframe_rule_json&&(this.$message.success({message:"Rule loaded."}),this.init_iframe_rule_json=""),this.uniparser_iframe_loaded=!0)},handleClick(e){e.name in this.clicked_tab_names||(this.clicked_tab_names[e.name]=1,"rules"==e.name&&this.load_hosts())},escape_html:e=>e?e.replace(/[&<>'"]/g,e=>({"&":"&amp;","<":"&lt;",">":"&gt;","'":"&#39;",'"':"&quot;"})[e]||e):"",show_time(e){var s='<table style="text-align: left;margin: 0 0 0 20%;font-weight: bold;">';JSON.parse(e.result_list||"[]"),s+='<tr><td>last_check_time</td><td class="time-td">'+e.last_check_time.replace(/\..*/,"").replace("T"," ")+"</td></tr>",s+='<tr><td>next_check_time</td><td class="time-td">'+e.next_check_time.replace(/\..*/,"").replace("T"," ")+"</td></tr>",s+='<tr><td>last_change_time</td><td class="time-td">'+e.last_change_time.replace(/\..*/,"").replace("T"," ")+"</td></tr>",s+="</table>",this.$alert(s,"Task result list: "+e.name,{confirmButtonText:"OK",center:!0,dangerouslyUseHTMLString:!0,closeOnClickModal:!0,closeOnPressEscape:!0})},get_latest_result(e,s=80){try{let t=JSON.parse(e);return t.title||t.text.slice(0,s)}catch(r){return e}},show_result_list(e){this.$http.post("lite",{task_id:e.task_id}).then(l=>{var s="<table>";l.body.result_list.forEach(e=>{if((result=e.result).url)var t='href="'+(result.url||"")+'"';else var t="";s+='<tr><td class="time-td">'+e.time+'</td><td><a target="_blank" '+t+">"+this.escape_html(result.title||result.text)+"</a></td></tr>"}),s+="</table>",this.$alert(s,"Task result list: "+e.name,{confirmButtonText:"OK",center:!0,dangerouslyUseHTMLString:!0,closeOnClickModal:!0,closeOnPressEscape:!0})},l=>{this.$message.error({message:"connect failed: "+l.status})})},force_crawl(e,s){this.$http.get("force_crawl",{params:{task_name:s.name}}).then(t=>{var r=t.body;if("ok"==r.msg){let a=r.task;Vue.set(this.task_list,e,a),a.error?this.$message.error({message:"Crawl task "+s.name+" "+a.error}):this.$message.success({message:"Crawl task "+s.name+" success"})}else this.$message.error({message:"Crawl task "+s.name+" failed: "+r.msg})},e=>{this.$message.error({message:"force_crawl connect failed: "+e.status})})},row_db_click(e){this.update_task(e)},show_task_error(e){app.$alert(e.error,"Crawler Error",{closeOnClickModal:!0,closeOnPressEscape:!0,center:!0})},update_task(e){this.new_task_form={task_id:e.task_id,name:e.name,enable:e.enable,tag:e.tag,request_args:e.request_args,origin_url:e.origin_url,interval:e.interval,work_hours:e.work_hours,max_result_count:e.max_result_count,result_list:e.result_list||"[]",custom_info:e.custom_info},this.show_form_add_new_task(!1)},delete_task(e,s){this.$confirm("Are you sure?","Confirm",{confirmButtonText:"Delete",cancelButtonText:"Cancel",type:"warning"}).then(()=>{this.$http.get("delete_task",{params:{task_id:s.task_id}}).then(t=>{var r=t.body;"ok"==r.msg?(this.$message.success({message:"Delete task "+s.name+" success"}),this.task_list.splice(e,1)):this.$message.error({message:"Delete task "+s.name+" failed: "+r.msg})},e=>{this.$message.error({message:"connect failed: "+e.status})})}).catch(()=>{this.$message({type:"info",message:"Canceled"})})},delete_host_rule(e){this.$confirm("Are you sure?","Confirm",{confirmButtonText:"Delete",cancelButtonText:"Cancel",type:"warning"}).then(()=>{this.$http.get("delete_host_rule",{params:{host:e}}).then(s=>{var t=s.body;"ok"==t.msg?(this.$message.success({message:"Delete host "+e+" rule success"}),this.current_host_rule={},this.rule_info_visible=!1,this.load_hosts()):this.$message.error({message:"Delete host "+e+" rule failed: "+JSON.stringify(t)})},e=>{this.$message.error({message:"connect failed: "+e.status})})}).catch(()=>{this.$message({type:"info",message:"Canceled"})})},show_host_rule(e){this.$http.get("get_host_rule",{params:{host:e}}).then(s=>{var t=s.body;"ok"==t.msg?(this.current_host_rule=t.host_rule,this.rule_info_visible=!0):this.$message.error({message:"get_host_rule "+e+" failed: "+JSON.stringify(t)})},e=>{this.$message.error({message:"connect failed: "+e.status})})},show_work_hours_doc(){let e=`<textarea style="height: ${3*window.innerHeight/4}px;width: 100%;">${this.work_hours_doc}</textarea  >`;this.$alert(e,"work_hours format doc",{dangerouslyUseHTMLString:!0,closeOnClickModal:!0,closeOnPressEscape:!0,customClass:"work_hours_doc"})},check_error_task({row:e,rowIndex:s}){if(e.error)return"warning-row"},click_cb_name(e){this.current_cb_doc=this.callback_workers[e],this.new_task_form.custom_info=e+":"},update_frequency(){let e=this.current_host_rule.host,s=this.current_host_rule.n||0,t=this.current_host_rule.interval||0;this.$http.get("update_host_freq",{params:{host:e,n:s,interval:t}}).then(r=>{var a=r.body;"ok"==a.msg?(this.$message({message:"Update frequency "+e+": "+a.msg,type:"success"}),this.current_host_rule.n=s,this.current_host_rule.interval=t):this.$message.error({message:"update_frequency "+e+" failed: "+JSON.stringify(a)})},e=>{this.$message.error({message:"connect failed: "+e.status})})}},watch:{current_host:function(e){this.visible_host_list=[],/^https?:\/\//g.test(e)&&(e=new URL(e).hostname,this.current_host=e),this.host_list.forEach(s=>{s.name.includes(e)&&this.visible_host_list.push(s)})},task_info_visible:function(e){e||(this.current_cb_doc="")}},computed:{uni_iframe:()=>document.getElementById("uni_iframe"),sub_app(){let e=this.uni_iframe;if(e)return e.contentWindow.app}}},vue_app=Vue.extend(Main),app=new vue_app({delimiters:["${","}"]}).$mount("#app");(()=>{var e;let s=document.getElementById("init_vars"),t=JSON.parse(window.atob(s.innerHTML));Object.keys(t).forEach(e=>{app[e]=t[e]}),s.parentNode.removeChild(s),new IntersectionObserver(e=>{!(e[0].intersectionRatio<=0)&&app.has_more&&app.load_tasks()}).observe(document.getElementById("auto_load"))})();
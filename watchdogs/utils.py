@@ -1,12 +1,18 @@
 import re
-from datetime import datetime
-from inspect import isawaitable
+from asyncio import Future, ensure_future, shield
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache, update_wrapper
+from gzip import compress as gzip_compress
+from hashlib import blake2b
+from inspect import isawaitable, signature
 from json import dumps, loads
 from logging import getLogger
 from sys import _getframe
 from traceback import format_exc
-from typing import Optional
-from xml.sax.saxutils import escape
+from typing import (Callable, Dict, Hashable, Iterable, Iterator, Optional,
+                    Set)
+from xml.sax.saxutils import escape, quoteattr
 
 logger = getLogger('watchdogs')
 
@@ -22,36 +28,292 @@ def format_size(size, rounded=2):
     return f'{round(size, rounded)} {unit}'
 
 
+def to_datetime(value) -> datetime:
+    """The datetime of the db value or str(datetime), sqlite returns the str
+    of the raw sql. datetime.fromisoformat is python3.7+."""
+    if isinstance(value, datetime):
+        return value
+    value = str(value).replace('T', ' ')
+    if '.' in value:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
 async def ensure_await_result(result):
     if isawaitable(result):
         return await result
     return result
 
 
-def _check_work_time(work_hours, now: Optional[datetime] = None):
-    now = now or datetime.now()
-    if '==' in work_hours:
-        # check work days, using strftime
-        fmt, target = work_hours.split('==')
-        current = now.strftime(fmt)
-        # check current time format equals to target
-        return current == target
-    elif '!=' in work_hours:
-        # check work days, using strftime
-        fmt, target = work_hours.split('!=')
-        current = now.strftime(fmt)
-        # check current time format equals to target
-        return current != target
-    else:
-        # other hours format
-        current_hour = now.hour
+# the finest time unit of the strftime directives, the formatted string will
+# not change until the next boundary of the unit
+SECOND, MINUTE, HOUR, DAY, MONTH, YEAR = range(6)
+STRFTIME_UNITS = {
+    **dict.fromkeys('SfcXTrs', SECOND),
+    **dict.fromkeys('MR', MINUTE),
+    **dict.fromkeys('HIklp', HOUR),
+    **dict.fromkeys('aAwudjUWVxDeFGg', DAY),
+    **dict.fromkeys('bBhm', MONTH),
+    **dict.fromkeys('yYCzZ%', YEAR),
+}
+
+
+# width, min and max of the numeric strftime directives
+STRFTIME_NUMBERS = {
+    **dict.fromkeys('YG', (4, 1, 9999)),
+    **dict.fromkeys('yCg', (2, 0, 99)),
+    'm': (2, 1, 12),
+    'd': (2, 1, 31),
+    'j': (3, 1, 366),
+    'H': (2, 0, 23),
+    'I': (2, 1, 12),
+    'M': (2, 0, 59),
+    'S': (2, 0, 61),
+    'w': (1, 0, 6),
+    'u': (1, 1, 7),
+    **dict.fromkeys('UW', (2, 0, 53)),
+    'V': (2, 1, 53),
+}
+
+
+def next_boundary(time: datetime, unit: int) -> datetime:
+    """The start of the next unit after the time."""
+    if unit == SECOND:
+        return time.replace(microsecond=0) + timedelta(seconds=1)
+    elif unit == MINUTE:
+        return time.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    elif unit == HOUR:
+        return time.replace(minute=0, second=0,
+                            microsecond=0) + timedelta(hours=1)
+    day = time.replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit == DAY:
+        return day + timedelta(days=1)
+    elif unit == MONTH:
+        if day.month == 12:
+            return day.replace(year=day.year + 1, month=1, day=1)
+        return day.replace(month=day.month + 1, day=1)
+    return day.replace(year=day.year + 1, month=1, day=1)
+
+
+class StrftimeClause:
+    """%w==5 / %H!=11, compare the now.strftime(fmt) with the target.
+
+    The target is split by the directives of fmt, so the clause could jump to
+    the boundary of its coarsest unmatched directive, and a target which
+    strftime never gives (%M==60) is known at once."""
+    __slots__ = ('fmt', 'target', 'equal', 'unit', 'parts', 'never')
+
+    def __init__(self, fmt: str, target: str, equal: bool):
+        self.fmt = fmt
+        self.target = target
+        self.equal = equal
+        units = [
+            STRFTIME_UNITS.get(directive, SECOND)
+            for directive in re.findall(r'%-?(.)', fmt)
+        ]
+        self.unit = min(units) if units else YEAR
+        # [(unit, directive, target value)], the coarser first
+        self.parts: Optional[list] = None
+        # strftime(fmt) never equals the target
+        self.never = False
+        self.split_target()
+
+    def split_target(self):
+        tokens = re.split(r'(%-?.)', self.fmt)
+        pattern, directives, variables = [], [], 0
+        for index, token in enumerate(tokens):
+            if index % 2 == 0 or token == '%%':
+                pattern.append(re.escape('%' if index % 2 else token))
+                continue
+            number = STRFTIME_NUMBERS.get(token[-1])
+            if number and '-' not in token:
+                pattern.append(f'(\\d{{{number[0]}}})')
+            else:
+                variables += 1
+                pattern.append('(.*?)')
+            directives.append(token)
+        match = re.fullmatch(''.join(pattern), self.target)
+        if not match:
+            self.never = True
+            return
+        values = match.groups()
+        for token, value in zip(directives, values):
+            number = STRFTIME_NUMBERS.get(token[-1])
+            if number and not (value.isdigit() and
+                               number[1] <= int(value) <= number[2]):
+                self.never = True
+                return
+        if variables <= 1:
+            # ambiguous to split more than one variable width directives
+            self.parts = sorted(
+                ((STRFTIME_UNITS.get(token[-1], SECOND), token, value)
+                 for token, value in zip(directives, values)),
+                key=lambda part: part[0],
+                reverse=True)
+
+    def check(self, now: datetime) -> bool:
+        return (now.strftime(self.fmt) == self.target) == self.equal
+
+    def next_change(self, now: datetime) -> Optional[datetime]:
+        """The time when the result of check may change, None for never."""
+        if self.never:
+            return None
+        if self.equal and self.parts:
+            for unit, directive, value in self.parts:
+                if now.strftime(directive) != value:
+                    return next_boundary(now, unit)
+        return next_boundary(now, self.unit)
+
+
+class HoursClause:
+    """0, 24 / [1, 19], the hours of everyday."""
+    __slots__ = ('hours',)
+
+    def __init__(self, work_hours: str):
         if work_hours[0] == '[' and work_hours[-1] == ']':
-            work_hours_list = sorted(loads(work_hours))
+            self.hours = sorted(set(loads(work_hours)))
         else:
             nums = [int(num) for num in re.findall(r'\d+', work_hours)]
-            work_hours_list = sorted(range(*nums))
-        # check if current_hour is work hour
-        return current_hour in work_hours_list
+            self.hours = sorted(set(range(*nums)))
+
+    def check(self, now: datetime) -> bool:
+        return now.hour in self.hours
+
+    def next_change(self, now: datetime) -> Optional[datetime]:
+        """The start of the next work hour, None if no work hours."""
+        today = now.replace(minute=0, second=0, microsecond=0)
+        for hour in self.hours:
+            if 0 <= hour < 24 and hour > now.hour:
+                return today.replace(hour=hour)
+        for hour in self.hours:
+            if 0 <= hour < 24:
+                return today.replace(hour=hour) + timedelta(days=1)
+        return None
+
+
+class WorkHours:
+    """Compiled work_hours string, see check_work_time and crawler.find_next_check_time.
+
+    clauses are joined by '|' (any) or '&' / ';' (all), ends with the optional `#change_interval`."""
+    __slots__ = ('clauses', 'any', 'change_interval')
+
+    def __init__(self, work_hours: str):
+        self.change_interval: Optional[int] = None
+        if '#' in work_hours:
+            work_hours, change_interval = work_hours.split('#')
+            self.change_interval = int(change_interval)
+        self.any = '|' in work_hours
+        if self.any:
+            if '&' in work_hours or ';' in work_hours:
+                raise ValueError('| can not use with "&" or ";"')
+            parts = work_hours.split('|')
+        else:
+            parts = re.split('&|;', work_hours)
+        self.clauses = [self.compile_clause(part) for part in parts]
+
+    @staticmethod
+    def compile_clause(work_hours: str):
+        if '==' in work_hours:
+            return StrftimeClause(*work_hours.split('=='), True)
+        elif '!=' in work_hours:
+            return StrftimeClause(*work_hours.split('!='), False)
+        else:
+            return HoursClause(work_hours)
+
+    def check(self, now: datetime) -> bool:
+        if self.any:
+            return any(clause.check(now) for clause in self.clauses)
+        return all(clause.check(now) for clause in self.clauses)
+
+    def next_time(self,
+                  now: datetime,
+                  max_time: Optional[datetime] = None,
+                  max_steps: int = 1000) -> Optional[datetime]:
+        """The first time >= now which fits the work hours, None if not found
+        before max_time (8 years for the leap days) or in max_steps.
+
+        Jumps to the time when the failed clauses may change: for 'all', the latest
+        change of the failed clauses; for 'any', the earliest change of all the clauses.
+
+    :: Test Code
+
+        from watchdogs.utils import compile_work_hours, datetime
+
+        now = datetime.strptime('2026-10-18 12:34:56', '%Y-%m-%d %H:%M:%S')
+
+        cases = {
+            '%A==Friday;20, 24': '2026-10-23 20:00:00',
+            '%w==5|%H==03': '2026-10-19 03:00:00',
+            '%H:%M==03:30': '2026-10-19 03:30:00',
+            # leap days
+            '%m-%d==02-29': '2028-02-29 00:00:00',
+            '%m-%d==02-29;%Y!=2028': '2032-02-29 00:00:00',
+            # impossible or passed
+            '%M==60': None,
+            '%H:%M==25:00': None,
+            '%m-%d==02-30': None,
+            '%Y-%m-%d %H:%M:%S==2020-01-01 00:00:00': None,
+            '0, 0': None,
+        }
+        for work_hours, expect in cases.items():
+            result = compile_work_hours(work_hours).next_time(now)
+            print(result, work_hours)
+            assert str(result) == str(expect)
+        # 2100 is not a leap year
+        now = datetime.strptime('2097-03-01', '%Y-%m-%d')
+        result = compile_work_hours('%m-%d==02-29').next_time(now)
+        assert str(result) == '2104-02-29 00:00:00'
+        """
+        max_time = max_time or now + timedelta(days=366 * 8)
+        time = now
+        for _ in range(max_steps):
+            if time > max_time:
+                break
+            if self.any:
+                if any(clause.check(time) for clause in self.clauses):
+                    return time
+                changes = [
+                    change for change in (clause.next_change(time)
+                                          for clause in self.clauses)
+                    if change is not None
+                ]
+                if not changes:
+                    return None
+                time = min(changes)
+            else:
+                failed = [
+                    clause for clause in self.clauses if not clause.check(time)
+                ]
+                if not failed:
+                    return time
+                changes = [clause.next_change(time) for clause in failed]
+                if None in changes:
+                    # some failed clause will never change
+                    return None
+                time = max(changes)
+        return None
+
+
+@lru_cache(maxsize=1024)
+def compile_work_hours(work_hours: str) -> WorkHours:
+    return WorkHours(work_hours)
+
+
+@lru_cache(maxsize=1024)
+def _get_next_work_time(work_hours: str,
+                        minute: datetime) -> Optional[datetime]:
+    return compile_work_hours(work_hours).next_time(minute)
+
+
+def get_next_work_time(work_hours: str,
+                       now: datetime) -> Optional[datetime]:
+    """WorkHours.next_time cached by the minute of now."""
+    result = _get_next_work_time(work_hours,
+                                 now.replace(second=0, microsecond=0))
+    if result is not None and result < now:
+        # the work time passed within this minute
+        return compile_work_hours(work_hours).next_time(now)
+    return result
 
 
 def check_work_time(work_hours, now: Optional[datetime] = None):
@@ -99,17 +361,7 @@ def check_work_time(work_hours, now: Optional[datetime] = None):
 
 
     """
-    now = now or datetime.now()
-    if '|' in work_hours:
-        if '&' in work_hours or ';' in work_hours:
-            raise ValueError('| can not use with "&" or ";"')
-        return any((_check_work_time(partial_work_hour, now)
-                    for partial_work_hour in work_hours.split('|')))
-    else:
-        if ('&' in work_hours or ';' in work_hours) and '|' in work_hours:
-            raise ValueError('| can not use with "&" or ";"')
-        return all((_check_work_time(partial_work_hour, now)
-                    for partial_work_hour in re.split('&|;', work_hours)))
+    return compile_work_hours(work_hours).check(now or datetime.now())
 
 
 def get_watchdog_result(item):
@@ -252,6 +504,100 @@ class SoloLock:
         return self
 
 
+class DependentCache:
+    """Async LRU cache which records the dependency keys of each entry.
+
+    get_deps is called with the bound arguments of the function, returns the keys
+    like ('task', task_id), ('tag', tag), ('all',), then `invalidate(*keys)` only
+    evicts the entries depending on them. Concurrent misses share one future."""
+
+    def __init__(self,
+                 func: Callable,
+                 maxsize: int = 128,
+                 get_deps: Callable[..., Iterable[Hashable]] = None):
+        self.func = func
+        self.maxsize = maxsize
+        self.get_deps = get_deps
+        self.signature = signature(func)
+        self.cache: 'OrderedDict[tuple, Future]' = OrderedDict()
+        self.entry_deps: Dict[tuple, Set[Hashable]] = {}
+        self.dep_entries: Dict[Hashable, Set[tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+        update_wrapper(self, func)
+
+    async def __call__(self, *args, **kwargs):
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = tuple(bound.arguments.items())
+        future = self.cache.get(key)
+        if future is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return await shield(future)
+        self.misses += 1
+        future = ensure_future(self.func(*args, **kwargs))
+        deps = set(self.get_deps(**bound.arguments)) if self.get_deps else {
+            ('all',)
+        }
+        self._set(key, future, deps)
+        try:
+            return await shield(future)
+        except BaseException:
+            if self.cache.get(key) is future:
+                self._pop(key)
+            raise
+
+    def _set(self, key: tuple, future: Future, deps: Set[Hashable]):
+        self.cache[key] = future
+        self.entry_deps[key] = deps
+        for dep in deps:
+            self.dep_entries.setdefault(dep, set()).add(key)
+        while len(self.cache) > self.maxsize:
+            self._pop(next(iter(self.cache)))
+
+    def _pop(self, key: tuple):
+        self.cache.pop(key, None)
+        for dep in self.entry_deps.pop(key, ()):
+            keys = self.dep_entries.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self.dep_entries.pop(dep, None)
+
+    def invalidate(self, *deps: Hashable) -> int:
+        """Evict the entries depending on any of the deps, return the count."""
+        keys: Set[tuple] = set()
+        for dep in deps:
+            keys.update(self.dep_entries.get(dep, ()))
+        for key in keys:
+            self._pop(key)
+        return len(keys)
+
+    def cache_clear(self):
+        self.cache.clear()
+        self.entry_deps.clear()
+        self.dep_entries.clear()
+
+    def cache_info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.cache),
+            'maxsize': self.maxsize,
+        }
+
+
+def dependent_cache(maxsize: int = 128,
+                    get_deps: Callable[..., Iterable[Hashable]] = None):
+    """Decorator of DependentCache."""
+
+    def wrapper(func):
+        return DependentCache(func, maxsize=maxsize, get_deps=get_deps)
+
+    return wrapper
+
+
 async def try_catch(func, *args, **kwargs):
     try:
         return await ensure_await_result(func(*args, **kwargs))
@@ -268,19 +614,40 @@ def ignore_error(func, *args, **kwargs):
         return err
 
 
-def gen_rss(data):
-    nodes = []
-    channel = data['channel']
+class FeedRenderer:
+    """Render the feed piece by piece, the items could be a generator.
+
+    channel: {'title', 'link', 'description'}
+    item: {'title', 'link', 'guid', 'description', 'time' (datetime) or 'pubDate'}"""
+    media_type = 'application/xml'
+
+    def head(self, channel: dict) -> str:
+        raise NotImplementedError
+
+    def item(self, item: dict, first: bool = False) -> str:
+        raise NotImplementedError
+
+    def tail(self) -> str:
+        raise NotImplementedError
+
+    def render(self, channel: dict, items: Iterable[dict]) -> Iterator[str]:
+        yield self.head(channel)
+        for index, item in enumerate(items):
+            yield self.item(item, index == 0)
+        yield self.tail()
+
+    @staticmethod
+    def isoformat(time: Optional[datetime]) -> str:
+        # naive datetime is the local time
+        return (time or datetime.now()).astimezone().isoformat(
+            timespec='seconds')
+
+
+class RSSRenderer(FeedRenderer):
     item_keys = ['title', 'description', 'link', 'guid', 'pubDate']
-    for item in data['items']:
-        item_nodes = []
-        for key in item_keys:
-            value = item.get(key)
-            if value:
-                item_nodes.append(f'<{key}>{escape(value)}</{key}>')
-        nodes.append(''.join(item_nodes))
-    items_string = ''.join((f'<item>{tmp}</item>' for tmp in nodes))
-    return rf'''<?xml version="1.0" encoding="UTF-8" ?>
+
+    def head(self, channel: dict) -> str:
+        return rf'''<?xml version="1.0" encoding="UTF-8" ?>
 <rss version="2.0">
 <channel>
   <title>{channel['title']}</title>
@@ -293,12 +660,120 @@ def gen_rss(data):
     <width>32</width>
     <height>32</height>
    </image>
-  {items_string}
+  '''
+
+    def item(self, item: dict, first: bool = False) -> str:
+        if not item.get('pubDate') and item.get('time'):
+            item = dict(item,
+                        pubDate=item['time'].strftime('%a, %d %b %Y %H:%M:%S'))
+        item_nodes = []
+        for key in self.item_keys:
+            value = item.get(key)
+            if value:
+                item_nodes.append(f'<{key}>{escape(value)}</{key}>')
+        return f'<item>{"".join(item_nodes)}</item>'
+
+    def tail(self) -> str:
+        return '''
 </channel>
 </rss>
 '''
 
 
+class AtomRenderer(FeedRenderer):
+    media_type = 'application/atom+xml'
+
+    def head(self, channel: dict) -> str:
+        link = channel['link']
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>{escape(channel['title'])}</title>
+  <subtitle>{escape(channel['description'])}</subtitle>
+  <link href={quoteattr(link)}/>
+  <id>{escape(link)}/</id>
+  <icon>{escape(link)}/static/img/favicon.svg</icon>
+  <updated>{self.isoformat(None)}</updated>
+'''
+
+    def item(self, item: dict, first: bool = False) -> str:
+        guid = item.get('guid') or item.get('title') or ''
+        nodes = [
+            f'<title>{escape(item.get("title") or "")}</title>',
+            f'<id>urn:watchdogs:{get_content_hash(guid)}</id>',
+            f'<updated>{self.isoformat(item.get("time"))}</updated>',
+        ]
+        if item.get('link'):
+            nodes.append(f'<link href={quoteattr(item["link"])}/>')
+        if item.get('description'):
+            nodes.append(f'<summary>{escape(item["description"])}</summary>')
+        return f'  <entry>{"".join(nodes)}</entry>\n'
+
+    def tail(self) -> str:
+        return '</feed>\n'
+
+
+class JSONFeedRenderer(FeedRenderer):
+    media_type = 'application/feed+json'
+
+    def head(self, channel: dict) -> str:
+        link = channel['link']
+        head = dumps({
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': channel['title'],
+            'home_page_url': link,
+            'description': channel['description'],
+            'icon': f'{link}/static/img/favicon.svg',
+        })
+        # leave the items list open
+        return f'{head[:-1]}, "items": ['
+
+    def item(self, item: dict, first: bool = False) -> str:
+        data = {
+            'id': item.get('guid') or item.get('title') or '',
+            'url': item.get('link') or None,
+            'title': item.get('title') or '',
+            'content_text': item.get('description') or '',
+            'date_published': self.isoformat(item.get('time')),
+        }
+        return ('' if first else ', ') + dumps(data)
+
+    def tail(self) -> str:
+        return ']}\n'
+
+
+feed_renderers: Dict[str, FeedRenderer] = {
+    'rss': RSSRenderer(),
+    'atom': AtomRenderer(),
+    'json': JSONFeedRenderer(),
+}
+
+
+def gen_rss(data):
+    return ''.join(feed_renderers['rss'].render(data['channel'],
+                                                data['items']))
+
+
+class RenderedDocument:
+    """Rendered bytes with the gzip version and the ETag, for the cached feeds."""
+    __slots__ = ('content', 'gzip_content', 'etag', 'media_type')
+
+    def __init__(self, text: str, media_type: str = 'application/xml'):
+        self.content = text.encode('utf-8')
+        self.gzip_content = gzip_compress(self.content, compresslevel=6)
+        self.etag = f'"{get_content_hash(self.content)}"'
+        self.media_type = media_type
+
+    def match(self, if_none_match: str) -> bool:
+        """Check the If-None-Match header."""
+        if not if_none_match:
+            return False
+        etags = {
+            etag.strip().replace('W/', '', 1)
+            for etag in if_none_match.split(',')
+        }
+        return self.etag in etags or '*' in etags
+
+
 def get_result_key(result: dict):
     key = result.get('__key__', result.get('key'))
     if key:
@@ -307,4 +782,18 @@ def get_result_key(result: dict):
         return dumps(result, sort_keys=True)
 
 
+def get_content_hash(content) -> str:
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return blake2b(content, digest_size=16).hexdigest()
+
+
+def get_result_key_hash(result: dict) -> int:
+    """Signed 64-bit hash of the result key, fits the BIGINT column."""
+    key = str(get_result_key(result)).encode('utf-8')
+    return int.from_bytes(blake2b(key, digest_size=8).digest(),
+                          'big',
+                          signed=True)
+
+
 solo = SoloLock()